@@ -2,9 +2,25 @@
 # -*- coding: utf-8 -*-
 import glue
 
+import array
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import json
+import mmap
+import os
+import struct
+import sys
 import time
-from typing import Optional, List
+from multiprocessing import shared_memory
+from typing import Iterator, Optional, List, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 BOARD_W = 7
 BOARD_H = 6
@@ -17,6 +33,7 @@ PB = 'B'
 WIN = 'W'
 LOSE = 'L'
 TIE = 'T'
+UNKNOWN = '?'
 
 move_results_weights = {
     WIN: 1,
@@ -30,6 +47,10 @@ class Grid(object):
         self.h = h
         self.min_win = min_win
         self.columns = [[] for i in range(self.w)]
+        self.last_move = None
+        self.moves = 0
+        # columns of the discs put, in order, to take them back
+        self.history = []
 
     def get(self, x: int, y: int):
         """axes oriented top-right: y^.->x"""
@@ -72,29 +93,334 @@ class Grid(object):
         if len(column) >= self.h:
             raise RuntimeError('column is already full')
         column.append(value)
+        self.last_move = (x, len(column) - 1)
+        self.moves += 1
+        self.history.append(x)
+        return self
+
+    def undo(self):
+        """takes back the last disc put"""
+        if not self.history:
+            raise RuntimeError('no move to take back')
+        self.columns[self.history.pop()].pop()
+        self.moves -= 1
+        self._restore_last_move()
         return self
 
+    def _restore_last_move(self):
+        if self.history:
+            x = self.history[-1]
+            self.last_move = (x, self.height(x) - 1)
+        else:
+            self.last_move = None
+
+    @contextlib.contextmanager
+    def play(self, x: int, value: str):
+        """puts a disc for the time of the with block, taking it back afterwards"""
+        self.put(x, value)
+        try:
+            yield self
+        finally:
+            self.undo()
+
     def can_make_move(self, x: int) -> bool:
         return len(self.columns[x]) < self.h
 
-    @staticmethod
-    def parse(txt: str, min_win: Optional[int] = MIN_WIN_CONDITION):
+    def height(self, x: int) -> int:
+        return len(self.columns[x])
+
+    @classmethod
+    def parse(cls, txt: str, min_win: Optional[int] = MIN_WIN_CONDITION):
         lines = txt.strip().splitlines()[::-1]
         h = len(lines)
         w = len(lines[0])
-        grid = Grid(w=w, h=h, min_win=min_win)
+        grid = cls(w=w, h=h, min_win=min_win)
         for line in lines:
             for idx, cell in enumerate(line):
                 if cell in {PA, PB}:
                     grid.put(idx, cell)
         return grid
 
+    @classmethod
+    def from_moves(cls, moves: str, w: int = BOARD_W, h: int = BOARD_H, min_win: int = MIN_WIN_CONDITION):
+        """
+        Position after the columns played in turn, counted from 1 and starting with player A, like '4453'.
+        Raises ValueError on an unknown column, a full one or a move made after the game is over.
+        """
+        grid = cls(w=w, h=h, min_win=min_win)
+        for idx, column in enumerate(moves):
+            if grid.last_move_winner():
+                raise ValueError('move {} at {} made after the game is over'.format(column, idx + 1))
+            if not column.isdigit():
+                raise ValueError('unknown column {} at {}'.format(column, idx + 1))
+            move = int(column) - 1
+            if not 0 <= move < w:
+                raise ValueError('unknown column {} at {}'.format(column, idx + 1))
+            if not grid.can_make_move(move):
+                raise ValueError('column {} at {} is already full'.format(column, idx + 1))
+            grid.put(move, PA if idx % 2 == 0 else PB)
+        return grid
+
     def winner(self) -> Optional[str]:
         return WinChecker.winner(self)
 
+    def key(self) -> int:
+        """
+        Exact integer encoding of the position, in bitboard layout:
+        player A discs of every column plus a marker bit right above its top disc.
+        """
+        return self._columns_key(self.columns)
+
+    def mirror_key(self) -> int:
+        """key of the position mirrored left-right"""
+        return self._columns_key(self.columns[::-1])
+
+    def canonical_key(self) -> int:
+        """key shared by the position and its mirror image, as both have the same results"""
+        return min(self.key(), self.mirror_key())
+
+    def _columns_key(self, columns) -> int:
+        key = 0
+        for x, column in enumerate(columns):
+            offset = x * (self.h + 1)
+            for y, cell in enumerate(column):
+                if cell == PA:
+                    key |= 1 << (offset + y)
+            key |= 1 << (offset + len(column))
+        return key
+
+    def playable_cells(self) -> int:
+        """bitboard layout mask of the cells where the next discs would land"""
+        cells = 0
+        for x, column in enumerate(self.columns):
+            if len(column) < self.h:
+                cells |= 1 << (x * (self.h + 1) + len(column))
+        return cells
+
+    def cell_bit(self, x: int, y: int) -> int:
+        return 1 << (x * (self.h + 1) + y)
+
+    def winning_cells(self, player: str) -> int:
+        """bitboard layout mask of the empty cells that would complete a winning streak for the player"""
+        cells = 0
+        for x in range(self.w):
+            for y in range(len(self.columns[x]), self.h):
+                if WinChecker.completes_streak(self, x, y, player):
+                    cells |= 1 << (x * (self.h + 1) + y)
+        return cells
+
+    def last_move_winner(self) -> Optional[str]:
+        """winner made by the last disc put, checking only the lines passing through it"""
+        if self.last_move is None:
+            return None
+        return WinChecker.move_winner(self, *self.last_move)
+
     def clone(self):
         copy = Grid(w=self.w, h=self.h, min_win=self.min_win)
         copy.columns = [column[:] for column in self.columns]
+        copy.last_move = self.last_move
+        copy.moves = self.moves
+        copy.history = self.history[:]
+        return copy
+
+
+class BitboardGrid(Grid):
+    """
+    Grid keeping the discs in two integer bitboards: player A discs and all occupied cells.
+    Column x takes bits x*(h+1) .. x*(h+1)+h-1 plus one always empty sentinel bit on top,
+    so that shifted alignments never wrap from one column to another.
+    Mirrored bitboards are kept alongside to get the mirror image key for free.
+    """
+    def __init__(self, w=BOARD_W, h=BOARD_H, min_win=MIN_WIN_CONDITION):
+        self.w = w
+        self.h = h
+        self.min_win = min_win
+        self.a_mask = 0
+        self.mask = 0
+        self.a_mirror = 0
+        self.mask_mirror = 0
+        self.bottom = sum(1 << (x * (h + 1)) for x in range(w))
+        self.board_mask = self.bottom * ((1 << h) - 1)
+        self.heights = [0] * w
+        self.last_move = None
+        self.moves = 0
+        self.history = []
+
+    @classmethod
+    def from_key(cls, key: int, w: int = BOARD_W, h: int = BOARD_H, min_win: int = MIN_WIN_CONDITION):
+        """position encoded by key(), with the discs of every column in history bottom up"""
+        grid = cls(w, h, min_win)
+        for x in range(w):
+            offset = x * (h + 1)
+            column = (key >> offset) & ((1 << (h + 1)) - 1)
+            height = column.bit_length() - 1
+            discs = (1 << height) - 1
+            mirror_offset = (w - 1 - x) * (h + 1)
+            grid.mask |= discs << offset
+            grid.mask_mirror |= discs << mirror_offset
+            grid.a_mask |= (column & discs) << offset
+            grid.a_mirror |= (column & discs) << mirror_offset
+            grid.heights[x] = height
+            grid.history.extend([x] * height)
+            grid.moves += height
+        return grid
+
+    def _bit(self, x: int, y: int) -> int:
+        return 1 << (x * (self.h + 1) + y)
+
+    @property
+    def columns(self):
+        return [[self.get(x, y) for y in range(self.heights[x])] for x in range(self.w)]
+
+    def get(self, x: int, y: int):
+        """axes oriented top-right: y^.->x"""
+        if y >= self.heights[x]:
+            return None
+        return PA if self.a_mask & self._bit(x, y) else PB
+
+    def set(self, x: int, y: int, value: Optional[str]):
+        if y >= self.heights[x]:
+            raise IndexError('cell is empty')
+        bit = self._bit(x, y)
+        mirror_bit = self._bit(self.w - 1 - x, y)
+        if value == PA:
+            self.a_mask |= bit
+            self.a_mirror |= mirror_bit
+        elif value == PB:
+            self.a_mask &= ~bit
+            self.a_mirror &= ~mirror_bit
+        else:
+            raise ValueError('bitboard cell can only hold a player disc')
+
+    def put(self, x: int, value: Optional[str]):
+        y = self.heights[x]
+        if y >= self.h:
+            raise RuntimeError('column is already full')
+        bit = 1 << (x * (self.h + 1) + y)
+        mirror_bit = 1 << ((self.w - 1 - x) * (self.h + 1) + y)
+        self.mask |= bit
+        self.mask_mirror |= mirror_bit
+        if value == PA:
+            self.a_mask |= bit
+            self.a_mirror |= mirror_bit
+        self.heights[x] = y + 1
+        self.last_move = (x, y)
+        self.moves += 1
+        self.history.append(x)
+        return self
+
+    def undo(self):
+        if not self.history:
+            raise RuntimeError('no move to take back')
+        x = self.history.pop()
+        y = self.heights[x] - 1
+        bit = ~(1 << (x * (self.h + 1) + y))
+        mirror_bit = ~(1 << ((self.w - 1 - x) * (self.h + 1) + y))
+        self.mask &= bit
+        self.mask_mirror &= mirror_bit
+        self.a_mask &= bit
+        self.a_mirror &= mirror_bit
+        self.heights[x] = y
+        self.moves -= 1
+        self._restore_last_move()
+        return self
+
+    def can_make_move(self, x: int) -> bool:
+        return self.heights[x] < self.h
+
+    def height(self, x: int) -> int:
+        return self.heights[x]
+
+    def playable_cells(self) -> int:
+        return (self.mask + self.bottom) & self.board_mask
+
+    def winner(self) -> Optional[str]:
+        if self._aligned(self.a_mask):
+            return PA
+        if self._aligned(self.mask ^ self.a_mask):
+            return PB
+        return None
+
+    def key(self) -> int:
+        # adding bottom row turns each column of occupied cells into a single bit above its top disc
+        return self.a_mask + self.mask + self.bottom
+
+    def mirror_key(self) -> int:
+        return self.a_mirror + self.mask_mirror + self.bottom
+
+    def canonical_key(self) -> int:
+        key = self.a_mask + self.mask + self.bottom
+        mirror_key = self.a_mirror + self.mask_mirror + self.bottom
+        return key if key < mirror_key else mirror_key
+
+    def last_move_winner(self) -> Optional[str]:
+        if self.last_move is None:
+            return None
+        x, y = self.last_move
+        bit = self._bit(x, y)
+        if self.a_mask & bit:
+            player, board = PA, self.a_mask
+        else:
+            player, board = PB, self.mask ^ self.a_mask
+        for shift in (1, self.h + 1, self.h, self.h + 2):
+            streak = 1
+            # count discs on both sides of the last one, sentinel bits stop the walk
+            for k in range(1, self.min_win):
+                if not board & (bit << (k * shift)):
+                    break
+                streak += 1
+            for k in range(1, self.min_win - streak + 1):
+                if not board & (bit >> (k * shift)):
+                    break
+                streak += 1
+            if streak >= self.min_win:
+                return player
+        return None
+
+    def winning_cells(self, player: str) -> int:
+        board = self.a_mask if player == PA else self.mask ^ self.a_mask
+        # vertical streak can only be completed on its top
+        cells = self.board_mask
+        for k in range(1, self.min_win):
+            cells &= board << k
+        for shift in (self.h + 1, self.h, self.h + 2):
+            # lower[k] - cells with k player discs right before them, upper[k] - right after them
+            lower = [self.board_mask]
+            upper = [self.board_mask]
+            for k in range(1, self.min_win):
+                lower.append(lower[-1] & (board << (k * shift)))
+                upper.append(upper[-1] & (board >> (k * shift)))
+            for gap in range(self.min_win):
+                cells |= lower[gap] & upper[self.min_win - 1 - gap]
+        return cells & self.board_mask & ~self.mask
+
+    def _aligned(self, board: int) -> bool:
+        """checks if there's a winning streak of discs: vertical, horizontal and both diagonals"""
+        for shift in (1, self.h + 1, self.h, self.h + 2):
+            streak = board
+            for k in range(1, self.min_win):
+                streak &= board >> (k * shift)
+                if not streak:
+                    break
+            if streak:
+                return True
+        return False
+
+    def clone(self):
+        copy = self.__class__.__new__(self.__class__)
+        copy.w = self.w
+        copy.h = self.h
+        copy.min_win = self.min_win
+        copy.a_mask = self.a_mask
+        copy.mask = self.mask
+        copy.a_mirror = self.a_mirror
+        copy.mask_mirror = self.mask_mirror
+        copy.bottom = self.bottom
+        copy.board_mask = self.board_mask
+        copy.heights = self.heights[:]
+        copy.last_move = self.last_move
+        copy.moves = self.moves
+        copy.history = self.history[:]
         return copy
 
 
@@ -108,6 +434,44 @@ class WinChecker(object):
     def winner(grid: Grid) -> Optional[str]:
         return WinChecker(grid)._winner()
 
+    @staticmethod
+    def batch_winners(boards, min_win: int = MIN_WIN_CONDITION):
+        """
+        Winners of many boards at once, given as NumPy array of shape (N, h, w):
+        boards[n, y, x] with y counted from the bottom like in Grid.get, 1 for player A disc, 2 for B, 0 if empty.
+        Returns array of N codes: 1 if player A has a winning streak, else 2 if B has one, 0 for no winner.
+        Streaks are found by ANDing the board masks shifted along each direction, for all the boards together.
+        Requires NumPy.
+        """
+        import numpy as np
+        boards = np.asarray(boards)
+        n, h, w = boards.shape
+        winners = np.zeros(n, dtype=np.int8)
+        for code in (2, 1):
+            discs = boards == code
+            found = np.zeros(n, dtype=bool)
+            # (dy, dx) steps along a streak: vertical, horizontal and both diagonals
+            for dy, dx in ((1, 0), (0, 1), (1, 1), (1, -1)):
+                rows = h - (min_win - 1) * dy
+                columns = w - (min_win - 1) * abs(dx)
+                if rows <= 0 or columns <= 0:
+                    continue
+                x0 = (min_win - 1) if dx < 0 else 0
+                streaks = discs[:, :rows, x0:x0 + columns].copy()
+                for k in range(1, min_win):
+                    streaks &= discs[:, k * dy:k * dy + rows, x0 + k * dx:x0 + k * dx + columns]
+                found |= streaks.any(axis=(1, 2))
+            winners[found] = code
+        return winners
+
+    @staticmethod
+    def boards_array(grids):
+        """NumPy array of shape (N, h, w) of the grids of the same size, as taken by batch_winners"""
+        import numpy as np
+        codes = {PA: 1, PB: 2, None: 0}
+        return np.array([[[codes[cell] for cell in row] for row in grid.to2d_yx()] for grid in grids],
+                        dtype=np.int8)
+
     def __init__(self, grid: Grid):
         self.grid = grid
         self.yx = grid.to2d_yx()
@@ -117,7 +481,6 @@ class WinChecker(object):
             self._check_vertical()
             self._check_horizontal()
             self._check_diagonal()
-            self._check_diagonal()
         except WinCondition as e:
             return e.winner
 
@@ -148,6 +511,30 @@ class WinChecker(object):
             self._check_list(self._diagonal_sublist(self.grid.w - 1, ystart, -1, +1), self.grid.min_win)
 
 
+    @staticmethod
+    def move_winner(grid: Grid, x: int, y: int) -> Optional[str]:
+        """checks only the 4 lines passing through the disc at (x, y), O(min_win) instead of O(w*h)"""
+        disc = grid.get(x, y)
+        if disc is None:
+            return None
+        return disc if WinChecker.completes_streak(grid, x, y, disc) else None
+
+    @staticmethod
+    def completes_streak(grid: Grid, x: int, y: int, disc: str) -> bool:
+        """checks if a disc at (x, y) is part of a winning streak with the neighbouring discs"""
+        for xstep, ystep in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            streak = 1
+            for direction in (1, -1):
+                cx, cy = x + xstep * direction, y + ystep * direction
+                while 0 <= cx < grid.w and 0 <= cy < grid.h and streak < grid.min_win \
+                        and grid.get(cx, cy) == disc:
+                    streak += 1
+                    cx += xstep * direction
+                    cy += ystep * direction
+            if streak >= grid.min_win:
+                return True
+        return False
+
     @staticmethod
     def _check_list(l, min_win):
         """checks if there's a winning streak"""
@@ -185,29 +572,393 @@ def min_possible_move(posible_moves_results) -> str:
 
 
 class ResultsCache(object):
-    def __init__(self):
+    """
+    Results of the positions solved so far.
+    Optional backing DiskResultsCache is looked up on a miss, e.g. results saved by previous runs.
+    """
+    def __init__(self, backing: Optional['DiskResultsCache'] = None):
         self.cache = {}
+        self.backing = backing
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     @staticmethod
-    def hashcode(grid: Grid):
-        # FIXME hashcode collissions are risky here
-        return hash(str(grid.columns))
+    def hashcode(grid: Grid) -> int:
+        # mirrored positions have the same results, so they share an entry
+        return grid.canonical_key()
 
     def get(self, grid: Grid) -> str:
-        return self.cache.get(self.hashcode(grid))
+        key = self.hashcode(grid)
+        result = self.cache.get(key)
+        if result is None and self.backing is not None:
+            result = self.backing.get_key(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
 
     def put(self, grid: Grid, result: str):
         if result:
             self.cache[self.hashcode(grid)] = result
 
+    def items(self):
+        """(key, result) pairs kept in memory"""
+        return self.cache.items()
+
+    def flush(self, path: str, w: int, h: int, min_win: int, perspective: Optional[str]):
+        """
+        saves the results kept in memory together with the backing ones to a DiskResultsCache file,
+        merging both sorted by the key on the fly, so the backing results are never loaded to memory at once
+        """
+        backing_items = self.backing.items() if self.backing is not None else ()
+        DiskResultsCache.save(path, _merge_sorted_items(sorted(self.items()), backing_items),
+                              w, h, min_win, perspective)
+
+    def __len__(self):
+        return len(self.cache)
+
+
+def _merge_sorted_items(newer, older) -> Iterator[Tuple[int, object]]:
+    """(key, value) pairs of two sequences sorted by the key, the newer value wins for the same key"""
+    older = iter(older)
+    old = next(older, None)
+    for key, value in newer:
+        while old is not None and old[0] < key:
+            yield old
+            old = next(older, None)
+        if old is not None and old[0] == key:
+            old = next(older, None)
+        yield key, value
+    while old is not None:
+        yield old
+        old = next(older, None)
+
+
+def _next_prime(n: int) -> int:
+    n = max(n, 2)
+    while any(n % d == 0 for d in range(2, int(n ** 0.5) + 1)):
+        n += 1
+    return n
+
+
+class TranspositionTable(ResultsCache):
+    """
+    Results cache of a fixed capacity, preallocated up front, so it never grows during a search.
+    Positions are hashed into buckets by key modulo a prime, colliding entries are resolved
+    by the replacement policy:
+    - ALWAYS_REPLACE: one slot per bucket, the newest entry wins,
+    - DEPTH_PREFERRED: two slots per bucket, the first keeps the entry with the biggest
+      remaining subtree (most empty cells), the second one is always replaced.
+    """
+    ALWAYS_REPLACE = 'always'
+    DEPTH_PREFERRED = 'depth'
+    # approximate memory taken by one slot: list references and the key int object
+    ENTRY_BYTES = 64
+
+    def __init__(self, capacity: Optional[int] = None, max_bytes: Optional[int] = None,
+                 policy: str = DEPTH_PREFERRED, backing: Optional['DiskResultsCache'] = None):
+        super(TranspositionTable, self).__init__(backing)
+        if capacity is None:
+            if max_bytes is None:
+                raise ValueError('either capacity or max_bytes is required')
+            capacity = max_bytes // self.ENTRY_BYTES
+        if policy not in {self.ALWAYS_REPLACE, self.DEPTH_PREFERRED}:
+            raise ValueError('unknown replacement policy: {}'.format(policy))
+        self.policy = policy
+        self.bucket_size = 2 if policy == self.DEPTH_PREFERRED else 1
+        self.buckets = _next_prime(capacity // self.bucket_size)
+        self.capacity = self.buckets * self.bucket_size
+        self.keys = [None] * self.capacity
+        self.results = [None] * self.capacity
+        self.depths = [0] * self.capacity
 
-iterations = 0
+    def get(self, grid: Grid) -> str:
+        key = self.hashcode(grid)
+        index = (key % self.buckets) * self.bucket_size
+        for slot in range(index, index + self.bucket_size):
+            if self.keys[slot] == key:
+                self.hits += 1
+                return self.results[slot]
+        result = self.backing.get_key(key) if self.backing is not None else None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def put(self, grid: Grid, result: str):
+        if not result:
+            return
+        key = self.hashcode(grid)
+        depth = grid.w * grid.h - grid.moves
+        slot = (key % self.buckets) * self.bucket_size
+        if self.policy == self.DEPTH_PREFERRED and self.keys[slot] != key:
+            if self.keys[slot + 1] == key or depth < self.depths[slot]:
+                # shallow entry goes to the always-replace slot
+                slot += 1
+        if self.keys[slot] is not None and self.keys[slot] != key:
+            self.evictions += 1
+        self.keys[slot] = key
+        self.results[slot] = result
+        self.depths[slot] = depth
+
+    def items(self):
+        return [(key, result) for key, result in zip(self.keys, self.results) if key is not None]
+
+    def __len__(self):
+        return self.capacity - self.keys.count(None)
+
+
+# cached values packed into integers: W/L/T results or (lower, upper) score bounds of 13 bits each
+CACHED_RESULTS = [None, WIN, LOSE, TIE]
+BOUNDS_TAG = 4
+BOUNDS_OFFSET = 1 << 12
+
+
+def encode_cache_value(value) -> int:
+    if isinstance(value, tuple):
+        lower, upper = value
+        return BOUNDS_TAG | (lower + BOUNDS_OFFSET) << 3 | (upper + BOUNDS_OFFSET) << 16
+    return CACHED_RESULTS.index(value)
+
+
+def decode_cache_value(data: int):
+    if data & BOUNDS_TAG:
+        return ((data >> 3) & 0x1fff) - BOUNDS_OFFSET, ((data >> 16) & 0x1fff) - BOUNDS_OFFSET
+    return CACHED_RESULTS[data]
+
+
+class SharedResultsCache(ResultsCache):
+    """
+    Fixed-size results cache living in shared memory, to be used by many processes at once.
+    Pickled cache attaches to the same memory block, so it can be passed to worker processes.
+    Slots are written without locking: each one keeps (key ^ data, data) words,
+    so a slot torn by concurrent writes no longer matches its key and reads as a miss.
+    Keys have to fit in 64 bits, that is boards up to w * (h + 1) <= 64.
+    """
+    SLOT = struct.Struct('<QQ')
+
+    def __init__(self, capacity: int = 1 << 20, name: Optional[str] = None):
+        super(SharedResultsCache, self).__init__()
+        self.cache = None
+        self.capacity = _next_prime(capacity) if name is None else capacity
+        self._attach(name)
+
+    def _attach(self, name: Optional[str]):
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.capacity * self.SLOT.size)
+            self.memory.buf[:self.capacity * self.SLOT.size] = bytes(self.capacity * self.SLOT.size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+    def __getstate__(self):
+        return {'name': self.memory.name, 'capacity': self.capacity}
+
+    def __setstate__(self, state):
+        self.__init__(state['capacity'], state['name'])
+
+    @staticmethod
+    def hashcode(grid: Grid) -> int:
+        key = grid.canonical_key()
+        if key >> 64:
+            raise ValueError('board is too big for the shared results cache')
+        return key
+
+    def get(self, grid: Grid):
+        key = self.hashcode(grid)
+        checked, data = self.SLOT.unpack_from(self.memory.buf, (key % self.capacity) * self.SLOT.size)
+        if data and checked ^ data == key:
+            self.hits += 1
+            return decode_cache_value(data)
+        self.misses += 1
+        return None
+
+    def put(self, grid: Grid, result):
+        if not result:
+            return
+        key = self.hashcode(grid)
+        data = encode_cache_value(result)
+        offset = (key % self.capacity) * self.SLOT.size
+        checked, old_data = self.SLOT.unpack_from(self.memory.buf, offset)
+        if old_data and checked ^ old_data != key:
+            self.evictions += 1
+        self.SLOT.pack_into(self.memory.buf, offset, key ^ data, data)
+
+    def items(self):
+        # torn slots don't decode to a key belonging there
+        return [
+            (checked ^ data, decode_cache_value(data))
+            for index, (checked, data) in enumerate(
+                self.SLOT.iter_unpack(self.memory.buf[:self.capacity * self.SLOT.size]))
+            if data and (checked ^ data) % self.capacity == index
+        ]
+
+    def __len__(self):
+        return sum(1 for _, data in self.SLOT.iter_unpack(self.memory.buf[:self.capacity * self.SLOT.size]) if data)
+
+    def close(self):
+        """detaches from the memory block, the creating process also removes it"""
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class DiskResultsCache(object):
+    """
+    Read-only results cache file, memory-mapped.
+    Header keeps the board variant and perspective of the results:
+    the player the W/L/T results are given for, or '-' for score bounds independent of the player.
+    Entries follow sorted by the key, each one being the key and its value packed by encode_cache_value.
+    """
+    MAGIC = b'C4RC'
+    HEADER = struct.Struct('<4sBBBcBQ')
+    VALUE = struct.Struct('<I')
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.w, self.h, self.min_win, perspective, self.key_bytes, self.count = \
+            self.HEADER.unpack_from(self.data)
+        if magic != self.MAGIC:
+            raise ValueError('not a results cache file: {}'.format(path))
+        self.perspective = None if perspective == b'-' else perspective.decode()
+        self.entry_size = self.key_bytes + self.VALUE.size
+        self.keys = _SortedKeys(self)
+
+    def matches(self, w: int, h: int, min_win: int, perspective: Optional[str]) -> bool:
+        """whether the results are valid for the board variant and perspective"""
+        return (self.w, self.h, self.min_win, self.perspective) == (w, h, min_win, perspective)
+
+    def key_at(self, index: int) -> int:
+        offset = self.HEADER.size + index * self.entry_size
+        return int.from_bytes(self.data[offset:offset + self.key_bytes], 'little')
+
+    def get_key(self, key: int):
+        index = bisect.bisect_left(self.keys, key)
+        if index == self.count or self.key_at(index) != key:
+            return None
+        offset = self.HEADER.size + index * self.entry_size + self.key_bytes
+        return decode_cache_value(self.VALUE.unpack_from(self.data, offset)[0])
+
+    def items(self):
+        for index in range(self.count):
+            offset = self.HEADER.size + index * self.entry_size
+            key = int.from_bytes(self.data[offset:offset + self.key_bytes], 'little')
+            yield key, decode_cache_value(self.VALUE.unpack_from(self.data, offset + self.key_bytes)[0])
+
+    def close(self):
+        self.data.close()
+
+    @classmethod
+    def save(cls, path: str, items, w: int, h: int, min_win: int, perspective: Optional[str]):
+        """
+        writes (key, value) pairs, given sorted by the key, to a new file, replacing the old one at once.
+        Pairs are written as they come, the count in the header is filled in at the end.
+        """
+        key_bytes = (w * (h + 1) + 7) // 8
+        temp_path = path + '.tmp'
+        count = 0
+        with open(temp_path, 'wb') as file:
+            file.write(bytes(cls.HEADER.size))
+            for key, value in items:
+                file.write(key.to_bytes(key_bytes, 'little'))
+                file.write(cls.VALUE.pack(encode_cache_value(value)))
+                count += 1
+            file.seek(0)
+            file.write(cls.HEADER.pack(cls.MAGIC, w, h, min_win, (perspective or '-').encode(), key_bytes, count))
+        os.replace(temp_path, path)
+
+
+class _SortedKeys(object):
+    """sequence view of the keys in a file sorted by them, for bisecting it"""
+    def __init__(self, sorted_file):
+        self.sorted_file = sorted_file
+
+    def __len__(self):
+        return self.sorted_file.count
+
+    def __getitem__(self, index: int) -> int:
+        return self.sorted_file.key_at(index)
+
+
+class SearchStats(object):
+    """
+    Counters of the searches made by a searcher: nodes visited, results cache hits and misses,
+    cutoffs by their type, depth reached in moves below the searched positions
+    and time spent on every depth of the iterative deepening.
+    Progress callback, if given, is called with the stats every interval nodes.
+    Searchers without stats don't count anything.
+    """
+    def __init__(self, progress=None, interval: int = 100000):
+        self.nodes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cutoffs = {}
+        self.depth_times = {}
+        self.shallowest = None
+        self.deepest = None
+        self.progress = progress
+        self.interval = interval
+        self.next_report = interval if progress is not None else float('inf')
+
+    def count_node(self, moves: int):
+        """counts a node visited with a number of moves on the board"""
+        self.nodes += 1
+        if self.deepest is None or moves > self.deepest:
+            self.deepest = moves
+        if self.shallowest is None or moves < self.shallowest:
+            self.shallowest = moves
+        if self.nodes >= self.next_report:
+            self.next_report = self.nodes + self.interval
+            self.progress(self)
+
+    def count_cache(self, hit: bool):
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    def count_cutoff(self, kind: str):
+        self.cutoffs[kind] = self.cutoffs.get(kind, 0) + 1
+
+    def add_depth_time(self, depth: int, seconds: float):
+        self.depth_times[depth] = self.depth_times.get(depth, 0) + seconds
+
+    @property
+    def max_depth(self) -> int:
+        """moves from the shallowest node visited to the deepest one"""
+        if self.deepest is None:
+            return 0
+        return self.deepest - self.shallowest
+
+    def to_dict(self) -> dict:
+        return {
+            'nodes': self.nodes,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cutoffs': dict(self.cutoffs),
+            'max_depth': self.max_depth,
+            'depth_times': {depth: round(seconds, 6) for depth, seconds in sorted(self.depth_times.items())},
+        }
+
+    def __repr__(self):
+        return 'SearchStats({})'.format(', '.join('{}={}'.format(k, v) for k, v in self.to_dict().items()))
 
 
 class DepthFirstSearcher(object):
-    def __init__(self, my_player: str):
+    # cached W/L/T results are given for my_player
+    cache_per_player = True
+
+    def __init__(self, my_player: str, results_cache: Optional[ResultsCache] = None,
+                 ordering: Optional['MoveOrdering'] = None, stats: Optional[SearchStats] = None):
         self.my_player = my_player
-        self.results_cache = ResultsCache()
+        self.results_cache = results_cache if results_cache is not None else ResultsCache()
+        self.ordering = ordering if ordering is not None else MoveOrdering()
+        self.stats = stats
 
 
     def best_result_on_move(self, grid: Grid, moving_player: str, move: int) -> str:
@@ -216,13 +967,21 @@ class DepthFirstSearcher(object):
             return None
         grid_after = grid.clone().put(move, moving_player)
 
+        winner = grid_after.last_move_winner()
+        if winner:
+            return WIN if winner == self.my_player else LOSE
+
         cached = self.results_cache.get(grid_after)
+        if self.stats is not None:
+            self.stats.count_cache(cached is not None)
+            if cached:
+                self.stats.count_cutoff('cache')
         if cached:
             return cached
 
         next_player = opposite_player(moving_player)
 
-        result = self.best_result(grid_after, next_player)
+        result = self._best_result(grid_after, next_player)
 
         if result:
             self.results_cache.put(grid_after, result)
@@ -230,149 +989,1338 @@ class DepthFirstSearcher(object):
 
 
     def best_result(self, grid: Grid, next_player: str) -> str:
-        global iterations
-        iterations += 1
-        if iterations % 100000 == 0:
-            print('iterations: ' + str(iterations))
-
         winner = grid.winner()
         if winner:
             if winner == self.my_player:
                 return WIN
             else:
                 return LOSE
-
-        # find further possible moves
-        posible_moves_results = []
-        for potential_move in range(grid.w):
-            move_result = self.best_result_on_move(grid, next_player, potential_move)
-
-            if move_result:
-                if self.my_player == next_player and move_result == WIN:
-                    return move_result
-                if self.my_player != next_player and move_result == LOSE:
-                    return move_result
-
-                posible_moves_results.append(move_result)
-        
-        if not posible_moves_results:
-            return TIE
-
-        # if analyzing my_player = next_player moves, best move is max 
-        if self.my_player == next_player:
-            return max_possible_move(posible_moves_results)
-        else: # opponent tries to minimize my winning moves
-            return min_possible_move(posible_moves_results)
-
-
-my_player = PA
-
-
-class PotentialMove(object):
-    def __init__(self, grid: Grid, move_player: str, move: int, parent = None):
-        self.grid = grid
-        self.move_player = move_player
-        self.move = move
-        self.parent = parent
-        self.children = []
-        self.result = None
-
-    def set_result(self, result):
+        return self._best_result(grid, next_player)
+
+    def _best_result(self, grid: Grid, next_player: str) -> str:
+        """
+        best result of a position with no winner yet.
+        Searched without recursion: the moves are made and taken back on the grid in place,
+        keeping a frame for every ply on an explicit stack, preallocated for the moves left.
+        """
+        result, moves, opponent_cells = self._moves_to_search(grid, next_player)
+        if result:
+            return result
+        stats = self.stats
+        my_player = self.my_player
+        cache_get, cache_put = self.results_cache.get, self.results_cache.put
+        put, undo, height, last_move_winner = grid.put, grid.undo, grid.height, grid.last_move_winner
+        column_bits = grid.h + 1
+        moves_before = grid.moves
+        size = grid.w * grid.h - moves_before + 1
+        # frame of every ply: player to move, moves to try, index of the next one,
+        # cells where the opponent would win and the best result so far
+        players = [None] * size
+        frames_moves = [None] * size
+        indexes = [0] * size
+        threats = [0] * size
+        bests = [None] * size
+        top = 0
+        players[0], frames_moves[0], threats[0] = next_player, moves, opponent_cells
+        try:
+            while True:
+                player = players[top]
+                index = indexes[top]
+                if index < len(frames_moves[top]):
+                    move = frames_moves[top][index]
+                    indexes[top] = index + 1
+                    if threats[top] >> (move * column_bits + height(move) + 1) & 1:
+                        # move would let the opponent win right above it
+                        result = LOSE if player == my_player else WIN
+                    else:
+                        put(move, player)
+                        winner = last_move_winner()
+                        if winner:
+                            result = WIN if winner == my_player else LOSE
+                        else:
+                            result = cache_get(grid)
+                            if stats is not None:
+                                stats.count_cache(result is not None)
+                                if result:
+                                    stats.count_cutoff('cache')
+                            if not result:
+                                next_player = opposite_player(player)
+                                result, moves, opponent_cells = self._moves_to_search(grid, next_player)
+                                if not result:
+                                    top += 1
+                                    players[top], frames_moves[top], threats[top] = next_player, moves, opponent_cells
+                                    indexes[top], bests[top] = 0, None
+                                    continue
+                                cache_put(grid, result)
+                        undo()
+                else:
+                    # all the moves tried, back to the position before the move leading here
+                    result = bests[top] or TIE
+                    if top == 0:
+                        return result
+                    cache_put(grid, result)
+                    undo()
+                    top -= 1
+                    player = players[top]
+
+                # if analyzing my_player moves, best move is max, opponent tries to minimize my winning moves
+                if (player == my_player and result == WIN) or (player != my_player and result == LOSE):
+                    if stats is not None:
+                        stats.count_cutoff('beta')
+                    bests[top] = result
+                    indexes[top] = len(frames_moves[top])
+                elif bests[top] is None:
+                    bests[top] = result
+                elif result == TIE:
+                    bests[top] = TIE  # neither a cutoff, nor worse than any other result
+        finally:
+            # leave the grid as it was given, also if the search gets interrupted
+            while grid.moves > moves_before:
+                grid.undo()
+
+    def _moves_to_search(self, grid: Grid, next_player: str) -> Tuple[Optional[str], List[int], int]:
+        """
+        Result of a position with no winner yet if it's decided by an immediate win or the threats,
+        otherwise the moves to search and the cells where the opponent would win.
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.count_node(grid.moves)
+        opponent = opposite_player(next_player)
+        next_player_wins = WIN if next_player == self.my_player else LOSE
+        opponent_wins = LOSE if next_player == self.my_player else WIN
+
+        # immediate win or forced block, without going deeper
+        playable = grid.playable_cells()
+        if grid.winning_cells(next_player) & playable:
+            if stats is not None:
+                stats.count_cutoff('threats')
+            return next_player_wins, [], 0
+        opponent_cells = grid.winning_cells(opponent)
+        forced = opponent_cells & playable
+        if forced & (forced - 1):
+            if stats is not None:
+                stats.count_cutoff('threats')
+            return opponent_wins, [], 0  # can't block 2 threats at once
+        if forced:
+            moves = [forced.bit_length() // (grid.h + 1)]
+        else:
+            moves = self.ordering.moves(grid, next_player)
+        if not moves:
+            return TIE, [], 0
+        return None, moves, opponent_cells
+
+
+def win_score(grid: Grid) -> int:
+    """score of the winning move just put: the sooner the win, the higher the score"""
+    return grid.w * grid.h - grid.moves + 1
+
+
+def score_result(score: int, my_move: bool) -> str:
+    """W/L/T view of a move score from the point of view of the moving player"""
+    if score == 0:
+        return TIE
+    return WIN if (score > 0) == my_move else LOSE
+
+
+class SearchTimeout(Exception):
+    """raised from the search when its time or nodes budget is used up"""
+
+
+class MoveSolution(object):
+    """
+    Result of a move found within a budget: proven W/L/T or UNKNOWN,
+    depth of the deepest search completed for the move,
+    and the heuristic evaluation from that search, positive when good for my player.
+    """
+    def __init__(self, result: str = UNKNOWN, depth: Optional[int] = None, evaluation: Optional[int] = None):
         self.result = result
-        for child in self.children:
-            # FIXME remove from queue as well
-            del child
-        self.children = []
-        self.recalculate()
-
-    def recalculate(self):
-        if self.parent:
+        self.depth = depth
+        self.evaluation = evaluation
 
-            if self.result == WIN and self.move_player == my_player:
-                self.parent.set_result(self.result)
+    def __repr__(self):
+        return 'MoveSolution({}, depth={}, evaluation={})'.format(self.result, self.depth, self.evaluation)
 
-            elif self.result == LOSE and self.move_player != my_player:
-                self.parent.set_result(self.result)
 
-            else:
-                child_results = [child.result for child in self.parent.children if child.result]
-                if len(child_results) == len(self.parent.children):
-                    # all the results are ready
-                    if self.move_player == my_player:
-                        self.parent.set_result(max_possible_move(child_results))
-                    else: # opponent tries to minimize my winning moves
-                        self.parent.set_result(min_possible_move(child_results))
+class NegamaxSearcher(object):
+    """
+    Alpha-beta negamax over numeric scores, taken from the point of view of the player to move:
+    positive when winning (the sooner, the higher), 0 for a tie, negative when losing.
+    Results cache keeps (lower, upper) bounds of the position score.
 
+    Search can be limited to a depth, then positions beyond the horizon are scored
+    either as lost (pessimistic) or as won (optimistic) for the player to move there.
+    Only the bounds such a search proves hold for the real score, so those are the only ones cached.
+    """
+    # cached score bounds are the same for both players
+    cache_per_player = False
 
-class BreadthFirstSearcher(object):
-    def __init__(self, my_player: str):
+    def __init__(self, my_player: str, results_cache: Optional[ResultsCache] = None,
+                 ordering: Optional['MoveOrdering'] = None, stats: Optional[SearchStats] = None):
         self.my_player = my_player
-        self.moves_que = []
+        self.results_cache = results_cache if results_cache is not None else ResultsCache()
+        self.ordering = ordering if ordering is not None else MoveOrdering()
+        self.stats = stats
+        self.horizon_hits = 0
+        # heuristic score bounds of the positions evaluated, by position key and depth
+        self.evaluations = {}
+        self.nodes = 0
+        self.deadline = None
+        self.max_nodes = None
+        self.next_budget_check = float('inf')
+
+    def set_budget(self, deadline: Optional[float] = None, max_nodes: Optional[int] = None):
+        """limit further searches to a deadline (time.time() timestamp) and to a number of nodes visited"""
+        self.deadline = deadline
+        self.max_nodes = None if max_nodes is None else self.nodes + max_nodes
+        self.next_budget_check = self.nodes if deadline is not None or max_nodes is not None else float('inf')
+
+    def _check_budget(self):
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            raise SearchTimeout()
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchTimeout()
+        # clock is checked every 1000 nodes
+        self.next_budget_check = self.nodes + 1000
+        if self.max_nodes is not None:
+            self.next_budget_check = min(self.next_budget_check, self.max_nodes)
+
+    def best_result_on_move(self, grid: Grid, moving_player: str, move: int) -> Optional[str]:
+        score = self.score_on_move(grid, moving_player, move)
+        if score is None:
+            return None
+        return score_result(score, moving_player == self.my_player)
 
+    def score_on_move(self, grid: Grid, moving_player: str, move: int) -> Optional[int]:
+        """exact score of a move, from the moving player point of view"""
+        if not grid.can_make_move(move):
+            return None
+        grid_after = grid.clone().put(move, moving_player)
+        if grid_after.last_move_winner():
+            return win_score(grid_after)
+        infinity = grid.w * grid.h + 1
+        return -self.negamax(grid_after, opposite_player(moving_player), -infinity, infinity)
+
+    def probe_result_on_move(self, grid: Grid, moving_player: str, move: int, depth: int) -> Optional[str]:
+        """
+        W/L/T result of a move proven by null-window searches limited to the depth after the move,
+        None if the move can't be made or the result lies beyond the horizon.
+        """
+        if not grid.can_make_move(move):
+            return None
+        grid_after = grid.clone().put(move, moving_player)
+        if grid_after.last_move_winner():
+            return score_result(1, moving_player == self.my_player)
+        next_player = opposite_player(moving_player)
+        # signs flipped: scores of the position after the move are the opponent's
+        above_loss = self.probe(grid_after, next_player, -1, depth)
+        if above_loss is False:
+            return score_result(1, moving_player == self.my_player)
+        above_tie = self.probe(grid_after, next_player, 0, depth)
+        if above_tie is True:
+            return score_result(-1, moving_player == self.my_player)
+        if above_tie is False and above_loss is True:
+            return TIE
+        return None
+
+    def probe(self, grid: Grid, player: str, bound: int, depth: int) -> Optional[bool]:
+        """
+        Null-window test whether the score of a position is greater than the bound.
+        None if it can't be told within the depth.
+        """
+        hits = self.horizon_hits
+        if self.negamax(grid, player, bound, bound + 1, depth, True) > bound:
+            return True
+        if self.horizon_hits == hits:
+            return False  # nothing was beyond the horizon, so failing low is proven too
+        if self.negamax(grid, player, bound, bound + 1, depth, False) <= bound:
+            return False
+        return None
+
+    def _score_or_moves(self, grid: Grid, player: str) -> Tuple[Optional[int], List[int]]:
+        """
+        Exact score if the position is decided within the next 2 moves,
+        otherwise the moves worth searching: blocking ones or not letting the opponent win right away.
+        """
+        cells = grid.w * grid.h
+        if grid.moves == cells:
+            return 0, []
+        playable = grid.playable_cells()
+        if grid.winning_cells(player) & playable:
+            return cells - grid.moves, []
+        opponent_cells = grid.winning_cells(opposite_player(player))
+        forced = opponent_cells & playable
+        opponent_win = -(cells - grid.moves - 1)
+        if forced & (forced - 1):
+            return opponent_win, []  # can't block 2 threats at once
+        if forced:
+            moves = [forced.bit_length() // (grid.h + 1)]
+        else:
+            moves = self.ordering.moves(grid, player)
+        # skip the moves letting the opponent win right above them
+        moves = [move for move in moves if not opponent_cells & grid.cell_bit(move, grid.height(move) + 1)]
+        if not moves:
+            return opponent_win, []
+        return None, moves
+
+    def evaluate(self, grid: Grid, player: str, alpha: int, beta: int, depth: int) -> int:
+        """
+        Heuristic score of a position with no winner yet, player to move:
+        depth-limited alpha-beta scoring the positions on the horizon by the difference of winning threats.
+        """
+        self.nodes += 1
+        if self.nodes >= self.next_budget_check:
+            self._check_budget()
+        if self.stats is not None:
+            self.stats.count_node(grid.moves)
+        score, moves = self._score_or_moves(grid, player)
+        if score is not None:
+            return score
+        next_player = opposite_player(player)
+        if depth == 0:
+            return bin(grid.winning_cells(player)).count('1') - bin(grid.winning_cells(next_player)).count('1')
+        cells = grid.w * grid.h
+        key = (grid.canonical_key(), depth)
+        lower, upper = self.evaluations.get(key, (-cells, cells))
+        if lower >= upper or lower >= beta:
+            return lower
+        if upper <= alpha:
+            return upper
+        window_alpha, window_beta = max(alpha, lower), min(beta, upper)
+        best = -cells
+        for move in moves:
+            grid.put(move, player)
+            try:
+                score = -self.evaluate(grid, next_player, -window_beta, -max(window_alpha, best), depth - 1)
+            finally:
+                grid.undo()
+            if score > best:
+                best = score
+                if best >= window_beta:
+                    break
+        # failing low or high only bounds the score
+        if best <= window_alpha:
+            upper = best
+        elif best >= window_beta:
+            lower = best
+        else:
+            lower = upper = best
+        self.evaluations[key] = (lower, upper)
+        return best
+
+    def evaluation_on_move(self, grid: Grid, moving_player: str, move: int, depth: int) -> Optional[int]:
+        """heuristic score of a move searched to the depth, positive when good for my player"""
+        if not grid.can_make_move(move):
+            return None
+        grid_after = grid.clone().put(move, moving_player)
+        if grid_after.last_move_winner():
+            score = win_score(grid_after)
+        else:
+            infinity = grid.w * grid.h + 1
+            score = -self.evaluate(grid_after, opposite_player(moving_player), -infinity, infinity, depth)
+        return score if moving_player == self.my_player else -score
+
+    def negamax(self, grid: Grid, player: str, alpha: int, beta: int,
+                depth: int = -1, pessimistic: bool = True) -> int:
+        """
+        Score of a position with no winner yet, player to move.
+        Exact if it's within (alpha, beta) window, otherwise it's only a bound beyond the window.
+        Negative depth searches to the end of the game.
+        """
+        self.nodes += 1
+        if self.nodes >= self.next_budget_check:
+            self._check_budget()
+        stats = self.stats
+        if stats is not None:
+            stats.count_node(grid.moves)
+        score, moves = self._score_or_moves(grid, player)
+        if score is not None:
+            if stats is not None:
+                stats.count_cutoff('threats')
+            return score
+        cells = grid.w * grid.h
+        next_player = opposite_player(player)
+
+        # without winning right now, the soonest win is on the next own move,
+        # and the opponent can't win on their next move either
+        lower = -max(0, cells - grid.moves - 3)
+        upper = max(0, cells - grid.moves - 2)
+        bounds = self.results_cache.get(grid)
+        if bounds:
+            lower, upper = max(lower, bounds[0]), min(upper, bounds[1])
+        if stats is not None:
+            stats.count_cache(bounds is not None)
+            if lower >= upper or lower >= beta or upper <= alpha:
+                stats.count_cutoff('cache' if bounds else 'bounds')
+        if lower >= upper or lower >= beta:
+            return lower
+        if upper <= alpha:
+            return upper
+        if depth == 0:
+            self.horizon_hits += 1
+            if stats is not None:
+                stats.count_cutoff('horizon')
+            return -cells if pessimistic else cells
+        alpha, beta = max(alpha, lower), min(beta, upper)
+
+        hits = self.horizon_hits
+        best = -cells
+        best_alpha = alpha
+        for move in moves:
+            # moves are made and taken back in place, also when the search runs out of budget
+            grid.put(move, player)
+            try:
+                score = -self.negamax(grid, next_player, -beta, -best_alpha, depth - 1, not pessimistic)
+            finally:
+                grid.undo()
+            if score > best:
+                best = score
+                if score > best_alpha:
+                    best_alpha = score
+                    if score >= beta:
+                        if stats is not None:
+                            stats.count_cutoff('beta')
+                        break
+
+        proven = self.horizon_hits == hits
+        if best <= alpha:
+            if proven or not pessimistic:
+                upper = min(upper, best)
+        elif best >= beta:
+            if proven or pessimistic:
+                lower = max(lower, best)
+        elif proven:
+            lower = upper = best
+        elif pessimistic:
+            lower = max(lower, best)
+        else:
+            upper = min(upper, best)
+        self.results_cache.put(grid, (lower, upper))
+        return best
+
+
+class IterativeDeepeningSearcher(NegamaxSearcher):
+    """
+    Solves moves with depth-limited null-window searches, going one move deeper every iteration.
+    Bounds proven by the shallow iterations stay in the results cache for the deeper ones.
+    """
+    def best_result_on_move(self, grid: Grid, moving_player: str, move: int) -> Optional[str]:
+        for depth in range(grid.w * grid.h - grid.moves):
+            start = time.perf_counter()
+            result = self.probe_result_on_move(grid, moving_player, move, depth)
+            if self.stats is not None:
+                self.stats.add_depth_time(depth, time.perf_counter() - start)
+            if result:
+                return result
+        return None
+
+    def iterate_moves_results(self, grid: Grid, moving_player: str,
+                              max_depth: Optional[int] = None) -> Iterator[Tuple[int, List[Optional[str]]]]:
+        """yields results of all the moves proven so far after every iteration"""
+        last_depth = grid.w * grid.h - grid.moves - 1
+        if max_depth is not None:
+            last_depth = min(last_depth, max_depth)
+        results = [None] * grid.w
+        for depth in range(last_depth + 1):
+            start = time.perf_counter()
+            for move in range(grid.w):
+                if results[move] is None:
+                    results[move] = self.probe_result_on_move(grid, moving_player, move, depth)
+            if self.stats is not None:
+                self.stats.add_depth_time(depth, time.perf_counter() - start)
+            yield depth, results[:]
+            if all(result or not grid.can_make_move(move) for move, result in enumerate(results)):
+                return
+
+    def solve_moves(self, grid: Grid, moving_player: str) -> List[Optional[MoveSolution]]:
+        """
+        Deepens the moves until they're proven or the budget runs out, see set_budget.
+        Moves not proven in time are UNKNOWN, with evaluation of the deepest search completed.
+        """
+        decided = _decided_results(grid, self.my_player)
+        if decided is not None:
+            return [MoveSolution(result, 0) if result else None for result in decided]
+        solutions = [MoveSolution() if grid.can_make_move(move) else None for move in range(grid.w)]
+        try:
+            for depth in range(grid.w * grid.h - grid.moves):
+                unknown = [move for move, solution in enumerate(solutions)
+                           if solution and solution.result == UNKNOWN]
+                if not unknown:
+                    break
+                start = time.perf_counter()
+                try:
+                    for move in unknown:
+                        result = self.probe_result_on_move(grid, moving_player, move, depth)
+                        solutions[move].result = result or UNKNOWN
+                        solutions[move].depth = depth
+                finally:
+                    if self.stats is not None:
+                        self.stats.add_depth_time(depth, time.perf_counter() - start)
+        except SearchTimeout:
+            pass
+        self._evaluate_unknown(grid, moving_player, solutions)
+        return solutions
+
+    def _evaluate_unknown(self, grid: Grid, moving_player: str, solutions: List[Optional[MoveSolution]]):
+        """
+        Evaluates the moves left unproven once the budget runs out, searched to the last depth completed by all.
+        Evaluations of the shallower depths would be thrown away by the deeper ones, so they aren't made at all.
+        Runs beyond the budget, though with its own transposition table it costs a fraction of the probes.
+        """
+        unknown = [move for move, solution in enumerate(solutions)
+                   if solution and solution.result == UNKNOWN and solution.depth is not None]
+        if not unknown:
+            return
+        # the moves probed before the budget ran out are evaluated to the depth all of them completed
+        depth = min(solutions[move].depth for move in unknown)
+        deadline, max_nodes = self.deadline, self.max_nodes
+        self.set_budget()
+        try:
+            for move in unknown:
+                solutions[move].evaluation = self.evaluation_on_move(grid, moving_player, move, depth)
+        finally:
+            self.evaluations.clear()
+            self.deadline, self.max_nodes = deadline, max_nodes
+            if deadline is not None or max_nodes is not None:
+                self.next_budget_check = self.nodes
+
+
+class SearchNodes(object):
+    """
+    Positions of the breadth-first search kept in parallel arrays, taking a few bytes per position:
+    its key, player to move, result, best result of its moves known so far and the number of its moves
+    with no result yet, plus the first of the edges to the positions it was reached from.
+    Edges of a position form a linked list: index of the parent position and of the next edge, -1 at the end.
+    """
+    CODES = [None, WIN, LOSE, TIE]
+    PLAYERS = [PA, PB]
+
+    def __init__(self, w: int, h: int, min_win: int):
+        self.w = w
+        self.h = h
+        self.min_win = min_win
+        # keys of the bigger boards don't fit in 64 bits
+        self.keys = array.array('Q') if w * (h + 1) <= 64 else []
+        self.players = array.array('B')
+        self.results = array.array('B')
+        self.bests = array.array('B')
+        self.pending = array.array('B')
+        self.first_edges = array.array('i')
+        self.edge_parents = array.array('i')
+        self.edge_next = array.array('i')
+
+    def add(self, key: int, player: str, parent: int = -1) -> int:
+        """adds a position reached from the parent one, returns its index"""
+        self.keys.append(key)
+        self.players.append(self.PLAYERS.index(player))
+        self.results.append(0)
+        self.bests.append(0)
+        self.pending.append(0)
+        self.first_edges.append(-1)
+        index = len(self.results) - 1
+        if parent >= 0:
+            self.add_parent(index, parent)
+        return index
+
+    def add_parent(self, index: int, parent: int):
+        self.edge_parents.append(parent)
+        self.edge_next.append(self.first_edges[index])
+        self.first_edges[index] = len(self.edge_parents) - 1
+
+    def parents(self, index: int) -> Iterator[int]:
+        edge = self.first_edges[index]
+        while edge >= 0:
+            yield self.edge_parents[edge]
+            edge = self.edge_next[edge]
+
+    def player(self, index: int) -> str:
+        return self.PLAYERS[self.players[index]]
+
+    def result(self, index: int) -> Optional[str]:
+        return self.CODES[self.results[index]]
+
+    def grid(self, index: int) -> 'BitboardGrid':
+        return BitboardGrid.from_key(self.keys[index], self.w, self.h, self.min_win)
+
+    def __len__(self):
+        return len(self.results)
+
+
+class BreadthFirstSearcher(DepthFirstSearcher):
+    """
+    Solves positions level by level: all the positions of one ply are expanded before the next one,
+    with the same positions of a ply merged into one, so its result reaches all the ways leading to it.
+    Positions are appended to SearchNodes ply after ply, so every ply is a range of their indices.
+    Results travel up through the parents as soon as they're known,
+    and queued positions with no unresolved parent left are dropped without expanding them.
+    Slower than DepthFirstSearcher even a few moves from the end of the game: without its cutoffs it visits
+    more positions and rebuilds the grid of each one from its key, e.g. on 25 random 7x6 positions
+    26 to 32 moves in, 9.2k positions in 0.62 s compared to 6.1k in 0.19 s.
+    """
+    def _best_result(self, grid: Grid, next_player: str) -> str:
+        nodes = SearchNodes(grid.w, grid.h, grid.min_win)
+        root = nodes.add(grid.key(), next_player)
+        ply_start, ply_end = 0, 1
+        while ply_start < ply_end and not nodes.results[root]:
+            next_ply = {}
+            # positions found resolved or unneeded during the ply are only noticed on the next one
+            alive_marks = {}
+            for index in range(ply_start, ply_end):
+                if self._alive(nodes, index, alive_marks):
+                    self._expand(nodes, index, next_ply)
+                elif self.stats is not None:
+                    self.stats.count_cutoff('pruned')
+            ply_start, ply_end = ply_end, len(nodes)
+        return nodes.result(root)
+
+    def _alive(self, nodes: SearchNodes, index: int, marks: dict) -> bool:
+        """whether the position still matters: no result yet and reached from a position that still matters"""
+        alive = marks.get(index)
+        if alive is None:
+            alive = not nodes.results[index] and (nodes.first_edges[index] < 0 or any(
+                self._alive(nodes, parent, marks) for parent in nodes.parents(index)))
+            marks[index] = alive
+        return alive
+
+    def _expand(self, nodes: SearchNodes, index: int, next_ply: dict):
+        """finds results of the moves from the position, adding the positions left to solve to the next ply"""
+        grid = nodes.grid(index)
+        player = nodes.player(index)
+        result, moves, opponent_cells = self._moves_to_search(grid, player)
+        if result:
+            nodes.results[index] = SearchNodes.CODES.index(result)
+            self._pass_up(nodes, index, grid)
+            return
+        nodes.pending[index] = len(moves)
+        for move in moves:
+            if nodes.results[index]:
+                break  # decided by the moves tried so far
+            if opponent_cells & grid.cell_bit(move, grid.height(move) + 1):
+                # move would let the opponent win right above it
+                move_result = LOSE if player == self.my_player else WIN
+            else:
+                with grid.play(move, player):
+                    winner = grid.last_move_winner()
+                    if winner:
+                        move_result = WIN if winner == self.my_player else LOSE
+                    else:
+                        move_result = self.results_cache.get(grid)
+                        if self.stats is not None:
+                            self.stats.count_cache(move_result is not None)
+                        if not move_result:
+                            key = grid.canonical_key()
+                            child = next_ply.get(key)
+                            if child is None:
+                                next_ply[key] = nodes.add(grid.key(), opposite_player(player), index)
+                            else:
+                                nodes.add_parent(child, index)
+                            continue
+            if self._recalculate(nodes, index, move_result):
+                self._pass_up(nodes, index, grid)
+
+    def _recalculate(self, nodes: SearchNodes, index: int, move_result: str) -> bool:
+        """takes the result of one of the moves into account, tells if it decided the position"""
+        if nodes.results[index]:
+            return False
+        player = nodes.player(index)
+        code = SearchNodes.CODES.index(move_result)
+        if (player == self.my_player and move_result == WIN) or (player != self.my_player and move_result == LOSE):
+            nodes.results[index] = code
+            return True
+        if not nodes.bests[index] or move_result == TIE:
+            nodes.bests[index] = code
+        nodes.pending[index] -= 1
+        if nodes.pending[index]:
+            return False
+        nodes.results[index] = nodes.bests[index]
+        return True
+
+    def _pass_up(self, nodes: SearchNodes, index: int, grid: Optional[Grid] = None):
+        """caches the result of a decided position and passes it to the positions it was reached from"""
+        decided = [(index, grid)]
+        while decided:
+            index, grid = decided.pop()
+            result = nodes.result(index)
+            self.results_cache.put(grid if grid is not None else nodes.grid(index), result)
+            for parent in nodes.parents(index):
+                if self._recalculate(nodes, parent, result):
+                    decided.append((parent, None))
+
+searchers = {
+    'dfs': DepthFirstSearcher,
+    'negamax': NegamaxSearcher,
+    'iterative': IterativeDeepeningSearcher,
+    'bfs': BreadthFirstSearcher,
+}
 
 
-    def best_result_bfs(self, grid: Grid, move_player: str, starting_move: int) -> str:
-        if grid.can_make_move(starting_move):
-            self.moves_que.append(PotentialMove(grid, move_player, starting_move))
+class MoveOrdering(object):
+    """order in which the searchers try the moves: left to right"""
+    def moves(self, grid: Grid, player: str) -> List[int]:
+        return [move for move in range(grid.w) if grid.can_make_move(move)]
 
-        while self.moves_que:
-            move = self.moves_que.popleft()
 
-            self.analyze_move(move)
-            move.recalculate()
-            # enque analyzing next level moves
+class CenterOrdering(MoveOrdering):
+    """center columns first, as they take part in the most streaks"""
+    def __init__(self):
+        self.orders = {}
+
+    def moves(self, grid: Grid, player: str) -> List[int]:
+        order = self.orders.get(grid.w)
+        if order is None:
+            order = sorted(range(grid.w), key=lambda move: abs(2 * move - grid.w + 1))
+            self.orders[grid.w] = order
+        return [move for move in order if grid.can_make_move(move)]
+
+
+class ThreatOrdering(CenterOrdering):
+    """moves creating the most winning threats first, center columns first among equal ones"""
+    def moves(self, grid: Grid, player: str) -> List[int]:
+        moves = super(ThreatOrdering, self).moves(grid, player)
+        threats = {}
+        for move in moves:
+            with grid.play(move, player):
+                threats[move] = bin(grid.winning_cells(player)).count('1')
+        return sorted(moves, key=lambda move: -threats[move])
+
+
+move_orderings = {
+    'natural': MoveOrdering,
+    'center': CenterOrdering,
+    'threats': ThreatOrdering,
+}
 
-            # check if move is valid or is ending the game
 
-            # if the results are ready - infer the conclusion
+class OpeningBook(object):
+    """
+    Moves results of all the positions up to a number of moves from the empty board,
+    given from the moving player point of view (player A moves first).
+    File is memory-mapped: header with the board variant, then entries sorted by the canonical key,
+    each one being the key and the results of the moves packed in 2 bits per column.
+    """
+    MAGIC = b'C4OB'
+    HEADER = struct.Struct('<4sBBBBBQ')
+    CODES = [None, WIN, LOSE, TIE]
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.w, self.h, self.min_win, self.depth, self.key_bytes, self.count = \
+            self.HEADER.unpack_from(self.data)
+        if magic != self.MAGIC:
+            raise ValueError('not an opening book file: {}'.format(path))
+        self.results_bytes = (self.w + 3) // 4
+        self.entry_size = self.key_bytes + self.results_bytes
+        self.keys = _SortedKeys(self)
+
+    def key_at(self, index: int) -> int:
+        offset = self.HEADER.size + index * self.entry_size
+        return int.from_bytes(self.data[offset:offset + self.key_bytes], 'little')
+
+    def get(self, grid: Grid, moving_player: str) -> Optional[List[str]]:
+        """moves results from the moving player point of view, None if the position is not in the book"""
+        if (grid.w, grid.h, grid.min_win) != (self.w, self.h, self.min_win) or grid.moves > self.depth:
+            return None
+        if moving_player != (PA if grid.moves % 2 == 0 else PB):
+            return None
+        key = grid.canonical_key()
+        index = bisect.bisect_left(self.keys, key)
+        if index == self.count or self.key_at(index) != key:
+            return None
+        offset = self.HEADER.size + index * self.entry_size + self.key_bytes
+        packed = int.from_bytes(self.data[offset:offset + self.results_bytes], 'little')
+        results = [self.CODES[(packed >> (2 * move)) & 3] for move in range(self.w)]
+        return results if grid.key() == key else results[::-1]
+
+    def close(self):
+        self.data.close()
+
+    @classmethod
+    def generate(cls, path: str, w: int, h: int, min_win: int, depth: int,
+                 engine: str = 'negamax', ordering: str = 'center') -> int:
+        """solves all the positions up to depth moves from the empty board, returns number of positions saved"""
+        players_searchers = players_searchers_for(engine, ordering, ResultsCache)
+        entries = []
+        positions = [BitboardGrid(w, h, min_win)]
+        for moves in range(depth + 1):
+            player = PA if moves % 2 == 0 else PB
+            searcher = players_searchers[player]
+            next_positions = {}
+            for grid in positions:
+                results = [searcher.best_result_on_move(grid, player, move) for move in range(w)]
+                key = grid.canonical_key()
+                if grid.key() != key:
+                    results = results[::-1]
+                entries.append((key, sum(cls.CODES.index(result) << (2 * move)
+                                         for move, result in enumerate(results))))
+                for move in range(w if moves < depth else 0):
+                    if grid.can_make_move(move):
+                        child = grid.clone().put(move, player)
+                        if not child.last_move_winner():
+                            next_positions.setdefault(child.canonical_key(), child)
+            positions = list(next_positions.values())
+
+        key_bytes = (w * (h + 1) + 7) // 8
+        results_bytes = (w + 3) // 4
+        entries.sort()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, w, h, min_win, depth, key_bytes, len(entries)))
+            for key, packed in entries:
+                file.write(key.to_bytes(key_bytes, 'little'))
+                file.write(packed.to_bytes(results_bytes, 'little'))
+        os.replace(temp_path, path)
+        return len(entries)
+
+
+class Tablebase(object):
+    """
+    Results of all the positions reachable on a small board, from the point of view of the player to move
+    (player A moves first), packed in 2 bits each and looked up by a perfect index of the position:
+    every column of the key (discs with a marker bit above them) is one of R = 2^(h+1)-1 codes,
+    the columns being digits of the index in base R. Table takes R^w / 4 bytes:
+    about 230 kB for 4x4, 7 MB for 5x4, 250 MB for 5x5.
+    File is memory-mapped: header with the board variant, then the packed results.
+    """
+    MAGIC = b'C4TB'
+    HEADER = struct.Struct('<4sBBB')
+    CODES = [None, WIN, LOSE, TIE]
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.w, self.h, self.min_win = self.HEADER.unpack_from(self.data)
+        if magic != self.MAGIC:
+            raise ValueError('not a tablebase file: {}'.format(path))
+        self.radix = (1 << (self.h + 1)) - 1
 
+    @staticmethod
+    def key_index(key: int, w: int, h: int) -> int:
+        """perfect index of the position with the key: mixed radix number of its column codes"""
+        radix = (1 << (h + 1)) - 1
+        index = 0
+        for x in reversed(range(w)):
+            index = index * radix + ((key >> (x * (h + 1))) & radix) - 1
+        return index
+
+    def result(self, grid: Grid) -> Optional[str]:
+        """result of the position for the player to move, None if it's not reachable"""
+        if (grid.w, grid.h, grid.min_win) != (self.w, self.h, self.min_win):
+            return None
+        index = self.key_index(grid.key(), self.w, self.h)
+        return self.CODES[(self.data[self.HEADER.size + (index >> 2)] >> (2 * (index & 3))) & 3]
 
-    def analyze_move(self, potential_move: PotentialMove):
-        grid2 = potential_move.grid.clone().put(potential_move.move, potential_move.move_player)
-        winner = grid2.winner()
-        if winner:
-            if winner == my_player:
-                potential_move.result = WIN
+    def get(self, grid: Grid, moving_player: str) -> Optional[List[str]]:
+        """moves results from the moving player point of view, like OpeningBook.get"""
+        if (grid.w, grid.h, grid.min_win) != (self.w, self.h, self.min_win):
+            return None
+        if moving_player != (PA if grid.moves % 2 == 0 else PB):
+            return None
+        swapped = {WIN: LOSE, LOSE: WIN, TIE: TIE, None: None}
+        results = []
+        for move in range(grid.w):
+            if not grid.can_make_move(move):
+                results.append(None)
+                continue
+            with grid.play(move, moving_player):
+                results.append(WIN if grid.last_move_winner() else swapped[self.result(grid)])
+        return results
+
+    def close(self):
+        self.data.close()
+
+    @classmethod
+    def generate(cls, path: str, w: int, h: int, min_win: int) -> int:
+        """
+        Enumerates the positions reachable from the empty board, ply by ply, then solves them backwards
+        from the last ply, every position from the results of the ones after it. Returns number of positions.
+        """
+        cells = w * h
+        table = bytearray(((1 << (h + 1)) - 1) ** w // 4 + 1)
+
+        def store(key: int, result: str):
+            index = cls.key_index(key, w, h)
+            table[index >> 2] |= cls.CODES.index(result) << (2 * (index & 3))
+
+        def load(key: int) -> str:
+            index = cls.key_index(key, w, h)
+            return cls.CODES[(table[index >> 2] >> (2 * (index & 3))) & 3]
+
+        count = 0
+        plies = [[BitboardGrid(w, h, min_win).key()]]
+        for moves in range(cells):
+            player = PA if moves % 2 == 0 else PB
+            next_ply = set()
+            for key in plies[moves]:
+                grid = BitboardGrid.from_key(key, w, h, min_win)
+                for move in range(w):
+                    if grid.can_make_move(move):
+                        with grid.play(move, player):
+                            if grid.last_move_winner():
+                                # game over, lost for the player to move
+                                if not load(grid.key()):
+                                    store(grid.key(), LOSE)
+                                    count += 1
+                            else:
+                                next_ply.add(grid.key())
+            plies.append(list(next_ply))
+
+        swapped = {WIN: LOSE, LOSE: WIN, TIE: TIE}
+        for moves in reversed(range(cells + 1)):
+            player = PA if moves % 2 == 0 else PB
+            for key in plies[moves]:
+                grid = BitboardGrid.from_key(key, w, h, min_win)
+                best = LOSE if moves < cells else TIE
+                for move in range(w):
+                    if best == WIN:
+                        break
+                    if grid.can_make_move(move):
+                        with grid.play(move, player):
+                            # results after the move are the opponent's
+                            result = WIN if grid.last_move_winner() else swapped[load(grid.key())]
+                        if move_results_weights[result] > move_results_weights[best]:
+                            best = result
+                store(key, best)
+                count += 1
+            plies[moves] = None
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, w, h, min_win))
+            file.write(table)
+        os.replace(temp_path, path)
+        return count
+
+
+def players_searchers_for(engine: str, ordering: str, cache_factory, stats: Optional[SearchStats] = None) -> dict:
+    """searchers of both players, sharing the results cache unless its results depend on the player"""
+    searcher_class = searchers[engine]
+    results_cache = cache_factory()
+    return {
+        player: searcher_class(player, cache_factory() if searcher_class.cache_per_player else results_cache,
+                               move_orderings[ordering](), stats)
+        for player in (PA, PB)
+    }
+
+
+def moves_results(grid, my_player, moving_player, results_cache: Optional[ResultsCache] = None,
+                  engine: str = 'dfs', ordering: str = 'natural', book: Optional[OpeningBook] = None,
+                  stats: Optional[SearchStats] = None) -> List[str]:
+    if book is not None:
+        results = book.get(grid, moving_player)
+        if results is not None:
+            if my_player == moving_player:
+                return results
+            swapped = {WIN: LOSE, LOSE: WIN, TIE: TIE, None: None}
+            return [swapped[result] for result in results]
+    searcher = searchers[engine](my_player, results_cache, move_orderings[ordering](), stats)
+    return _searcher_moves_results(searcher, grid, moving_player)
+
+
+def _decided_results(grid: Grid, my_player: str) -> Optional[List[str]]:
+    """
+    Results of the moves on a board already won, None if no one won yet.
+    Searches check only the last disc put, so the root position is checked here once.
+    """
+    winner = grid.winner()
+    if not winner:
+        return None
+    result = WIN if winner == my_player else LOSE
+    return [result if grid.can_make_move(move) else None for move in range(grid.w)]
+
+
+def _searcher_moves_results(searcher, grid: Grid, moving_player: str) -> List[str]:
+    decided = _decided_results(grid, searcher.my_player)
+    if decided is not None:
+        return decided
+    symmetric = grid.key() == grid.mirror_key()
+    results = []
+    for move in range(grid.w):
+        mirror_move = grid.w - 1 - move
+        if symmetric and mirror_move < move:
+            # symmetric position: mirrored move has the same result
+            results.append(results[mirror_move])
+        else:
+            results.append(searcher.best_result_on_move(grid, moving_player, move))
+    return results
+
+
+def batch_moves_results(positions, engine: str = 'dfs', ordering: str = 'natural', cache_factory=ResultsCache,
+                        stats: Optional[SearchStats] = None) -> Iterator[Tuple[tuple, List[str]]]:
+    """
+    Same as moves_results for many positions given as (grid, my_player, moving_player) tuples,
+    yielding each position with its moves results as soon as they are solved.
+    Positions of the same board size and discs to win, with the same player moving first,
+    share the searchers and their results cache, so subtrees common to several positions are solved once.
+    """
+    variants_searchers = {}
+    for position in positions:
+        grid, my_player, moving_player = position
+        # keys are unique only among boards of the same size, and don't tell which player moved first
+        variant = (grid.w, grid.h, grid.min_win, (grid.moves % 2 == 0) == (moving_player == PA))
+        if variant not in variants_searchers:
+            variants_searchers[variant] = players_searchers_for(engine, ordering, cache_factory, stats)
+        yield position, _searcher_moves_results(variants_searchers[variant][my_player], grid, moving_player)
+
+
+def _move_result(grid: Grid, my_player: str, moving_player: str, move: int, engine: str, ordering: str,
+                 results_cache: Optional[ResultsCache] = None) -> str:
+    searcher = searchers[engine](my_player, results_cache, move_orderings[ordering]())
+    try:
+        return searcher.best_result_on_move(grid, moving_player, move)
+    finally:
+        if isinstance(results_cache, SharedResultsCache):
+            results_cache.close()
+
+
+def moves_results_parallel(grid: Grid, my_player: str, moving_player: str, workers: Optional[int] = None,
+                           engine: str = 'dfs', ordering: str = 'natural', split_replies: bool = False,
+                           shared_cache_size: Optional[int] = None) -> List[str]:
+    """
+    Same as moves_results, but solving the moves in a pool of worker processes (CPU count by default).
+    With split_replies, opponent's replies to every move are solved as separate tasks
+    to keep the workers busy with more, smaller tasks.
+    With shared_cache_size, workers share results through a SharedResultsCache of that capacity.
+    """
+    results_cache = SharedResultsCache(shared_cache_size) if shared_cache_size else None
+    try:
+        return _moves_results_parallel(grid, my_player, moving_player, workers, engine, ordering,
+                                       split_replies, results_cache)
+    finally:
+        if results_cache is not None:
+            results_cache.close()
+
+
+def _moves_results_parallel(grid, my_player, moving_player, workers, engine, ordering,
+                            split_replies, results_cache) -> List[str]:
+    decided = _decided_results(grid, my_player)
+    if decided is not None:
+        return decided
+    symmetric = grid.key() == grid.mirror_key()
+    moves = [move for move in range(grid.w) if not (symmetric and grid.w - 1 - move < move)]
+    next_player = opposite_player(moving_player)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = {}
+        for move in moves:
+            grid_after = grid.clone().put(move, moving_player) if grid.can_make_move(move) else None
+            if not split_replies or grid_after is None or grid_after.last_move_winner():
+                tasks[move] = executor.submit(_move_result, grid, my_player, moving_player, move, engine, ordering,
+                                              results_cache)
             else:
-                potential_move.result = LOSE
-            return
+                tasks[move] = [
+                    executor.submit(_move_result, grid_after, my_player, next_player, reply, engine, ordering,
+                                    results_cache)
+                    for reply in range(grid.w) if grid_after.can_make_move(reply)
+                ]
+
+        results = [None] * grid.w
+        for move, task in tasks.items():
+            if not isinstance(task, list):
+                results[move] = task.result()
+            elif not task:
+                results[move] = TIE
+            elif next_player == my_player:
+                results[move] = max_possible_move([reply.result() for reply in task])
+            else:
+                results[move] = min_possible_move([reply.result() for reply in task])
+    for move in range(grid.w):
+        if move not in tasks:
+            results[move] = results[grid.w - 1 - move]
+    return results
+
+
+def solve(grid: Grid, my_player: str, moving_player: str,
+          deadline: Optional[float] = None, max_nodes: Optional[int] = None,
+          results_cache: Optional[ResultsCache] = None, ordering: str = 'center',
+          stats: Optional[SearchStats] = None) -> List[Optional[MoveSolution]]:
+    """
+    Results of the moves found within the budget: deadline as time.time() timestamp and/or nodes to visit.
+    Illegal moves are None, moves not proven in time are UNKNOWN with their best known evaluation.
+    """
+    searcher = IterativeDeepeningSearcher(my_player, results_cache, move_orderings[ordering](), stats)
+    searcher.set_budget(deadline, max_nodes)
+    return searcher.solve_moves(grid, moving_player)
+
+
+def parse_position(line: str, w: int, h: int, min_win: int) -> Tuple[Grid, str]:
+    """
+    Position and the player to move from a single line: either board rows from the top joined with '/',
+    like '..../..../.B../AAB.', or the columns played in turn (counted from 1) starting with player A, like '2231'.
+    Raises ValueError on a position that can't be reached in a game of w x h board or one already won.
+    """
+    line = line.strip()
+    if line.isdigit():
+        grid = BitboardGrid.from_moves(line, w, h, min_win)
+        player = PA if len(line) % 2 == 0 else PB
+    else:
+        rows = line.split('/')
+        if len(rows) != h or any(len(row) != w for row in rows):
+            raise ValueError('board is not {} rows of {} cells'.format(h, w))
+        unknown = set(line) - {'.', PA, PB, '/'}
+        if unknown:
+            raise ValueError('unknown cells: {}'.format(''.join(sorted(unknown))))
+        for x in range(w):
+            column = ''.join(row[x] for row in rows)
+            if column.lstrip('.').count('.'):
+                raise ValueError('floating disc in column {}'.format(x + 1))
+        grid = BitboardGrid.parse('\n'.join(rows), min_win=min_win)
+        a_discs = line.count(PA)
+        b_discs = grid.moves - a_discs
+        if a_discs not in (b_discs, b_discs + 1):
+            raise ValueError('impossible number of discs: {} of A, {} of B'.format(a_discs, b_discs))
+        player = PA if a_discs == b_discs else PB
+    if grid.winner():
+        raise ValueError('game already won by {}'.format(grid.winner()))
+    return grid, player
+
+
+def analyze_positions(lines, w: int, h: int, min_win: int, engine: str = 'negamax', ordering: str = 'center',
+                      cache_factory=ResultsCache, stats: Optional[SearchStats] = None) -> Iterator[dict]:
+    """
+    Solves positions given one per line (see parse_position), yielding the moves results of each one,
+    from the moving player point of view. Searchers and their caches stay warm between the positions.
+    """
+    # parse errors and lines of the positions being solved, in the input order
+    pending = collections.deque()
+
+    def positions():
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                grid, player = parse_position(line, w, h, min_win)
+            except (ValueError, IndexError, RuntimeError) as e:
+                pending.append({'position': line.strip(), 'error': str(e)})
+                continue
+            pending.append(line.strip())
+            yield grid, player, player
+
+    for (grid, player, _), results in batch_moves_results(positions(), engine, ordering, cache_factory, stats):
+        while isinstance(pending[0], dict):
+            yield pending.popleft()
+        yield {'position': pending.popleft(), 'player': player, 'results': results}
+    yield from pending
+
+
+# name, board width, height, discs to win and the columns played, solved from the moving player point of view
+benchmark_positions = [
+    ('4x4 opening', 4, 4, 4, ''),
+    ('5x4 opening', 5, 4, 4, '33'),
+    ('6x5 opening', 6, 5, 4, '343434'),
+    ('7x6 midgame', 7, 6, 4, '34251535762155623157'),
+    ('7x6 endgame', 7, 6, 4, '11763622345327374177645526'),
+]
+
+
+def run_benchmark(positions=None, engine: str = 'negamax', ordering: str = 'center',
+                  cache_factory=ResultsCache) -> Iterator[dict]:
+    """
+    Solves the reference positions one by one, each with a fresh results cache,
+    yielding the results and performance measurements of each one.
+    Peak memory is the one of the whole process so far, as reported by the OS.
+    """
+    for name, w, h, min_win, moves in positions or benchmark_positions:
+        grid = BitboardGrid.from_moves(moves, w, h, min_win)
+        player = PA if grid.moves % 2 == 0 else PB
+        stats = SearchStats()
+        start = time.perf_counter()
+        results = moves_results(grid, player, player, cache_factory(), engine, ordering, stats=stats)
+        duration = time.perf_counter() - start
+        lookups = stats.cache_hits + stats.cache_misses
+        yield {
+            'position': name,
+            'board': '{}x{}'.format(w, h),
+            'moves': moves,
+            'results': results,
+            'nodes': stats.nodes,
+            'time': round(duration, 6),
+            'nodes_per_sec': round(stats.nodes / duration) if duration else None,
+            'cache_hit_rate': round(stats.cache_hits / lookups, 4) if lookups else None,
+            'max_depth': stats.max_depth,
+            'cutoffs': stats.cutoffs,
+            'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        }
 
-        # find further possible moves, enque analyzing next level moves
-        next_player = opposite_player(potential_move.move_player)
-        next_moves = []
-        for next_move in range(grid2.w):
-            if grid2.can_make_move(next_move):
-                next_moves.append(next_move)
-                potential_move.children.append()
-        
-        if not next_moves:
-            potential_move.result = TIE
-            return
 
+def now() -> float:
+    return datetime.datetime.now()
 
-def moves_results(grid, my_player, moving_player) -> List[str]:
-    searcher = DepthFirstSearcher(my_player)
-    return [searcher.best_result_on_move(grid, moving_player, move) for move in range(grid.w)]
 
+def grid_from_params(ap) -> Grid:
+    w, h = int(ap.get_param('width') or 4), int(ap.get_param('height') or 4)
+    min_win = int(ap.get_param('min-win') or MIN_WIN_CONDITION)
+    moves = ap.get_param('moves')
+    if moves:
+        try:
+            return BitboardGrid.from_moves(moves, w, h, min_win)
+        except ValueError as e:
+            glue.fatal('invalid moves: {}'.format(e))
+    return BitboardGrid(w, h, min_win)
 
-def now() -> float:
-    return datetime.datetime.now()
+
+def stats_from_params(ap) -> SearchStats:
+    interval = int(ap.get_param('progress-interval') or 100000)
+    if not interval:
+        return SearchStats()
+    return SearchStats(lambda stats: print('nodes: {}'.format(stats.nodes)), interval)
 
 
 def find_moves_results_action(ap):
     print('searching for the moves results...')
-    grid = Grid(4, 4)
+    grid = grid_from_params(ap)
     grid.print()
+    moving_player = PA if grid.moves % 2 == 0 else PB
+    my_player = ap.get_param('player') or moving_player
+    engine = ap.get_param('engine') or 'dfs'
+    ordering = ap.get_param('ordering') or 'natural'
+    timeout = ap.get_param('timeout')
+    max_nodes = ap.get_param('max-nodes')
+    # W/L/T results depend on the player, score bounds don't
+    perspective = my_player if searchers[engine].cache_per_player and not (timeout or max_nodes) else None
+    workers = None if timeout or max_nodes else ap.get_param('workers')
+    if workers:
+        # workers keep their own counters and caches, away from this process
+        for param in ('book', 'tablebase', 'cache-file', 'progress-interval'):
+            if ap.get_param(param):
+                glue.warn('{} is not supported with workers, ignoring it'.format(param))
+    cache_file = None if workers else ap.get_param('cache-file')
+    backing = None
+    if cache_file and os.path.exists(cache_file):
+        backing = DiskResultsCache(cache_file)
+        if not backing.matches(grid.w, grid.h, grid.min_win, perspective):
+            glue.warn('results in {} are for another board or engine, ignoring them'.format(cache_file))
+            backing = None
+            cache_file = None
+    cache_size = ap.get_param('cache-size')
+    results_cache = TranspositionTable(int(cache_size), backing=backing) if cache_size else ResultsCache(backing)
+    stats = stats_from_params(ap)
     checkpoint = now()
-    for idx, result in enumerate(moves_results(grid, PA, PA)):
+    if timeout or max_nodes:
+        deadline = time.time() + float(timeout) if timeout else None
+        solutions = solve(grid, my_player, moving_player, deadline, int(max_nodes) if max_nodes else None,
+                          results_cache, ordering, stats)
+        for idx, solution in enumerate(solutions):
+            print('move: {}, {}'.format(idx, solution))
+        results = []
+    elif workers:
+        shared_cache_size = int(cache_size) if cache_size else None
+        results = moves_results_parallel(grid, my_player, moving_player, int(workers), engine, ordering,
+                                         ap.is_flag_set('split'), shared_cache_size)
+    elif engine == 'iterative':
+        searcher = IterativeDeepeningSearcher(my_player, results_cache, move_orderings[ordering](), stats)
+        results = [None] * grid.w
+        for depth, results in searcher.iterate_moves_results(grid, moving_player):
+            print('depth: {}, results: {}'.format(depth, ' '.join(result or UNKNOWN for result in results)))
+    else:
+        book = OpeningBook(ap.get_param('book')) if ap.get_param('book') else None
+        if ap.get_param('tablebase'):
+            book = Tablebase(ap.get_param('tablebase'))
+        results = moves_results(grid, my_player, moving_player, results_cache, engine, ordering, book, stats)
+    for idx, result in enumerate(results):
         print('move: {}, result: {}'.format(idx, result))
-    print('iterations: {}'.format(iterations))
+    if not workers:
+        print('nodes: {}, max depth: {}, cutoffs: {}'.format(stats.nodes, stats.max_depth, ' '.join(
+            '{}={}'.format(*cutoff) for cutoff in sorted(stats.cutoffs.items()))))
+        if stats.depth_times:
+            print('time per depth: {}'.format(' '.join('{}={:.3f}s'.format(*depth_time)
+                                                        for depth_time in sorted(stats.depth_times.items()))))
+        print('cache hits: {}, misses: {}, evictions: {}'.format(
+            results_cache.hits, results_cache.misses, results_cache.evictions))
     print('duration: {}s'.format(now() - checkpoint))
+    if cache_file:
+        results_cache.flush(cache_file, grid.w, grid.h, grid.min_win, perspective)
+        print('results saved to {}'.format(cache_file))
+
+
+def generate_book_action(ap):
+    grid = grid_from_params(ap)
+    depth = int(ap.get_param('depth') or 4)
+    path = ap.get_param('output', required=True)
+    print('generating opening book up to {} moves for {}x{} board...'.format(depth, grid.w, grid.h))
+    checkpoint = now()
+    count = OpeningBook.generate(path, grid.w, grid.h, grid.min_win, depth,
+                                 ap.get_param('engine') or 'negamax', ap.get_param('ordering') or 'center')
+    print('positions: {}, saved to {}'.format(count, path))
+    print('duration: {}s'.format(now() - checkpoint))
+
+
+def generate_tablebase_action(ap):
+    grid = grid_from_params(ap)
+    path = ap.get_param('output', required=True)
+    print('generating tablebase for {}x{} board...'.format(grid.w, grid.h))
+    checkpoint = now()
+    count = Tablebase.generate(path, grid.w, grid.h, grid.min_win)
+    print('positions: {}, saved to {}'.format(count, path))
+    print('duration: {}s'.format(now() - checkpoint))
+
+
+def analyze_batch_action(ap):
+    grid = grid_from_params(ap)
+    path = ap.get_param('input') or '-'
+    cache_size = ap.get_param('cache-size')
+    cache_factory = (lambda: TranspositionTable(int(cache_size))) if cache_size else ResultsCache
+    lines = sys.stdin if path == '-' else open(path)
+    try:
+        for analysis in analyze_positions(lines, grid.w, grid.h, grid.min_win, ap.get_param('engine') or 'negamax',
+                                          ap.get_param('ordering') or 'center', cache_factory):
+            print(json.dumps(analysis), flush=True)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+def benchmark_action(ap):
+    engine = ap.get_param('engine') or 'negamax'
+    ordering = ap.get_param('ordering') or 'center'
+    cache_size = ap.get_param('cache-size')
+    cache_factory = (lambda: TranspositionTable(int(cache_size))) if cache_size else ResultsCache
+    total_nodes, total_time = 0, 0
+    for measurement in run_benchmark(None, engine, ordering, cache_factory):
+        total_nodes += measurement['nodes']
+        total_time += measurement['time']
+        print(json.dumps(measurement), flush=True)
+    print(json.dumps({
+        'position': 'total',
+        'engine': engine,
+        'ordering': ordering,
+        'python': sys.version.split()[0],
+        'nodes': total_nodes,
+        'time': round(total_time, 6),
+        'nodes_per_sec': round(total_nodes / total_time) if total_time else None,
+    }), flush=True)
 
 
 def main():
     ap = glue.ArgsProcessor(app_name='Connect 4 solver', version='1.0.0', default_action=find_moves_results_action)
-    ap.add_param('player', help='select your player', choices=['A', 'B'])
+    ap.add_param('player', help='select your player, the one to move by default', choices=['A', 'B'])
+    ap.add_param('moves', help='start from the position after the columns played in turn, counted from 1, like 4453')
+    ap.add_param('width', help='board width, 4 by default')
+    ap.add_param('height', help='board height, 4 by default')
+    ap.add_param('min-win', help='number of discs in a row to win, 4 by default')
+    ap.add_param('cache-size', help='limit the results cache to a number of entries')
+    ap.add_param('engine', help='search engine to use', choices=sorted(searchers))
+    ap.add_param('ordering', help='order of trying the moves', choices=sorted(move_orderings))
+    ap.add_param('timeout', help='stop searching after a number of seconds and report the best known results')
+    ap.add_param('max-nodes', help='stop searching after visiting a number of nodes')
+    ap.add_param('progress-interval', help='report the progress every number of nodes, 100000 by default, 0 to disable')
+    ap.add_param('cache-file', help='start with the results saved in a file and save them there afterwards')
+    ap.add_param('workers', help='solve the moves in parallel with a number of worker processes, '
+                                 'sharing a results cache of cache-size entries')
+    ap.add_flag('split', help='with workers, solve the replies to the moves as separate tasks')
+    ap.add_param('book', help='look the position up in an opening book file first')
+    ap.add_param('tablebase', help='look the moves up in a tablebase file instead of searching')
+    book_ap = ap.add_subcommand('book', action=generate_book_action,
+                                help='generate opening book of all the positions up to a number of moves')
+    book_ap.add_param('depth', help='number of moves from the empty board, 4 by default')
+    book_ap.add_param('output', help='opening book file to write')
+    tablebase_ap = ap.add_subcommand('tablebase', action=generate_tablebase_action,
+                                     help='solve all the positions reachable on a small board')
+    tablebase_ap.add_param('output', help='tablebase file to write')
+    batch_ap = ap.add_subcommand('batch', action=analyze_batch_action,
+                                 help='solve positions read line by line, writing the results as JSON lines')
+    batch_ap.add_param('input', help='file with board rows joined with / or moves played, stdin by default')
+    ap.add_subcommand('benchmark', action=benchmark_action,
+                      help='solve the reference positions, writing the performance measurements as JSON lines')
     ap.process()
 
 
@@ -530,7 +530,7 @@ class SubArgsProcessor(object):
     def _invoke_action(self, action):
         if action is not None:
             # execute action(self) or action()
-            (args, _, _, _) = inspect.getargspec(action)
+            args = inspect.getfullargspec(action).args
             if args:
                 action(self)
             else:
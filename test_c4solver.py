@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 import mock
+import json
+import pickle
+import random
+
+import pytest
 
 from c4solver import *
 import sys
@@ -137,6 +142,77 @@ def test_grid_clone():
     assert grid2.get(1, 0) == PA
     assert grid2.get(1, 2) is None
 
+def test_grid_from_moves():
+    for cls in (Grid, BitboardGrid):
+        grid = cls.from_moves('4453', w=7, h=6)
+        assert grid.to2d_yx() == cls.parse('''
+.......
+.......
+.......
+.......
+...B...
+..BAA..
+''').to2d_yx()
+        assert grid.moves == 4
+        assert grid.last_move == (2, 0)
+        assert cls.from_moves('', w=4, h=4).moves == 0
+        with pytest.raises(ValueError):
+            cls.from_moves('45', w=4, h=4)
+        with pytest.raises(ValueError):
+            cls.from_moves('1x', w=4, h=4)
+        with pytest.raises(ValueError):
+            cls.from_moves(':', w=10, h=4)
+        with pytest.raises(ValueError):
+            cls.from_moves('0', w=4, h=4)
+        with pytest.raises(ValueError):
+            cls.from_moves('11111', w=4, h=4)
+        with pytest.raises(ValueError):
+            cls.from_moves('12121213', w=4, h=4)
+        assert cls.from_moves('121212', w=4, h=4).winner() is None
+
+
+def test_grid_undo_round_trip():
+    rng = random.Random(20)
+    for cls in (Grid, BitboardGrid):
+        grid = cls(w=5, h=4, min_win=3)
+        snapshots = []
+        for idx in range(15):
+            moves = [x for x in range(grid.w) if grid.can_make_move(x)]
+            snapshots.append((grid.key(), grid.mirror_key(), grid.moves, grid.last_move,
+                              [grid.height(x) for x in range(grid.w)], grid.to2d_yx()))
+            grid.put(rng.choice(moves), PA if idx % 2 == 0 else PB)
+        while snapshots:
+            grid.undo()
+            assert (grid.key(), grid.mirror_key(), grid.moves, grid.last_move,
+                    [grid.height(x) for x in range(grid.w)], grid.to2d_yx()) == snapshots.pop()
+        with pytest.raises(RuntimeError):
+            grid.undo()
+
+def test_grid_play_then_revert():
+    for cls in (Grid, BitboardGrid):
+        grid = cls.from_moves('2231', w=4, h=4)
+        key, last_move = grid.key(), grid.last_move
+        with grid.play(3, PB) as played:
+            assert played is grid
+            assert grid.get(3, 0) == PB
+            assert grid.last_move == (3, 0)
+            assert grid.moves == 5
+        assert (grid.key(), grid.last_move, grid.moves) == (key, last_move, 4)
+        with pytest.raises(ZeroDivisionError):
+            with grid.play(1, PB):
+                1 / 0
+        assert grid.key() == key
+        clone = grid.clone().undo()
+        assert clone.moves == 3 and grid.moves == 4
+
+def test_negamax_restores_grid_after_timeout():
+    grid = BitboardGrid.from_moves('44', w=7, h=6)
+    key = grid.key()
+    searcher = NegamaxSearcher(PA, ordering=CenterOrdering())
+    searcher.set_budget(max_nodes=500)
+    with pytest.raises(SearchTimeout):
+        searcher.negamax(grid, PA, -43, 43)
+    assert (grid.key(), grid.moves, grid.last_move) == (key, 2, (3, 1))
 
 # --- Test Win Checker
 
@@ -224,6 +300,24 @@ AAB
 ABB
 '''.strip(), min_win=2).winner() == PB
 
+def test_batch_winners():
+    np = pytest.importorskip('numpy')
+    rng = random.Random(24)
+    for w, h, min_win in ((7, 6, 4), (5, 4, 3), (4, 4, 2), (3, 3, 4)):
+        grids = []
+        for _ in range(200):
+            grid = Grid(w=w, h=h, min_win=min_win)
+            player = PA
+            while grid.winner() is None and any(grid.can_make_move(x) for x in range(w)):
+                grid.put(rng.choice([x for x in range(w) if grid.can_make_move(x)]), player)
+                player = opposite_player(player)
+            grids.append(grid)
+        boards = WinChecker.boards_array(grids)
+        assert boards.shape == (len(grids), h, w)
+        codes = {None: 0, PA: 1, PB: 2}
+        assert WinChecker.batch_winners(boards, min_win).tolist() == [codes[grid.winner()] for grid in grids]
+    assert WinChecker.batch_winners(np.zeros((0, 6, 7), dtype=np.int8)).tolist() == []
+
 # --- Move Best Results
 
 def test_best_result_simplest4():
@@ -297,3 +391,836 @@ def test_best_result_unfair_3x3_tic_tac_toe():
 
 
 
+# --- Test Bitboard Grid
+
+def test_bitboard_grid_print_and_parse():
+    grid = BitboardGrid.parse('''
+.......
+.......
+......B
+......B
+.B....A
+.A.A..B
+'''.strip())
+    with MockOutput() as mocko:
+        grid.print()
+        mocko.assert_contains('''
++---------------+
+| . . . . . . . |
+| . . . . . . . |
+| . . . . . . B |
+| . . . . . . B |
+| . B . . . . A |
+| . A . A . . B |
++---------------+
+'''.strip())
+    assert grid.get(1, 0) == PA
+    assert grid.get(1, 1) == PB
+    assert grid.get(0, 0) is None
+    assert grid.columns[6] == [PB, PA, PB, PB]
+    assert grid.can_make_move(6)
+    assert not BitboardGrid(2, 1).put(0, PA).can_make_move(0)
+
+def test_bitboard_grid_clone():
+    grid1 = BitboardGrid.parse('''
+.......
+.......
+......B
+......B
+.B....A
+.A.A..B
+'''.strip())
+    grid2 = grid1.clone()
+    grid1.set(1, 0, PB)
+    grid1.put(0, PA)
+
+    assert grid1.get(1, 0) == PB
+    assert grid2.get(1, 0) == PA
+    assert grid1.get(0, 0) == PA
+    assert grid2.get(0, 0) is None
+
+def test_bitboard_grid_winner():
+    boards = [
+        '.......\n.......\n......B\n.A....B\n.B.BA.A\n.A.AB.B',
+        '.......\n.......\n......A\n......A\n.B....A\n.A.A..A',
+        '.......\n.......\n......A\n......A\n.B.BBBB\nAA.ABBA',
+        '.......\n.......\n......A\n.....AA\n.B.BABB\nAA.ABBA',
+        '.......\n.......\n.B....B\n.AB..AA\n.BABABB\nABAABBA',
+        '...B...\n..BB...\n.BBB..B\nBAAA.AA\nAAAB.B.\nAABA.BA',
+        'B......\nA......\nB......\nA......\nB......\nA......',
+    ]
+    for board in boards:
+        assert BitboardGrid.parse(board).winner() == Grid.parse(board).winner()
+    assert BitboardGrid.parse('...\n.A.\nAAB', min_win=2).winner() == PA
+    assert BitboardGrid.parse('...\n..A\nABB', min_win=2).winner() == PB
+
+def test_bitboard_grid_search():
+    grid = BitboardGrid(w=3, h=3, min_win=2)
+    assert moves_results(grid, PA, PA) == [WIN, WIN, WIN]
+    grid = BitboardGrid.parse('''
+....
+ABAB
+ABAB
+ABAB
+'''.strip())
+    assert moves_results(grid, PA, PA) == [WIN, LOSE, WIN, LOSE]
+
+def test_last_move_winner():
+    grid = Grid.parse('''
+.......
+.......
+......A
+......A
+.B....A
+.A.A..B
+'''.strip())
+    assert grid.last_move_winner() is None
+    assert grid.clone().put(6, PA).last_move_winner() == PA
+    assert grid.clone().put(2, PA).last_move_winner() is None
+    assert grid.clone().put(2, PB).last_move_winner() is None
+    assert Grid().last_move_winner() is None
+    assert BitboardGrid().last_move_winner() is None
+
+def test_last_move_winner_matches_full_check():
+    rng = random.Random(51)
+    for grid_class in (Grid, BitboardGrid):
+        for w, h, min_win in [(7, 6, 4), (4, 4, 4), (3, 3, 2), (5, 4, 3), (8, 7, 5), (2, 3, 1)]:
+            for _ in range(30):
+                grid = grid_class(w=w, h=h, min_win=min_win)
+                player = PA
+                while True:
+                    moves = [x for x in range(w) if grid.can_make_move(x)]
+                    if not moves:
+                        break
+                    grid.put(rng.choice(moves), player)
+                    winner = grid.last_move_winner()
+                    assert winner == grid.winner()
+                    if winner:
+                        break
+                    player = opposite_player(player)
+
+def test_moves_results_on_won_position():
+    grid = BitboardGrid.parse('''
+A...
+A.B.
+A.B.
+A.B.
+'''.strip())
+    for engine in ('dfs', 'negamax', 'bfs'):
+        assert moves_results(grid, PB, PB, engine=engine) == [None, LOSE, LOSE, LOSE]
+        assert moves_results(grid, PA, PB, engine=engine) == [None, WIN, WIN, WIN]
+    assert moves_results_parallel(grid, PB, PB) == [None, LOSE, LOSE, LOSE]
+    assert list(batch_moves_results([(grid, PB, PB)]))[0][1] == [None, LOSE, LOSE, LOSE]
+    assert [solution and solution.result for solution in solve(grid, PB, PB)] == [None, LOSE, LOSE, LOSE]
+
+# --- Results Cache
+
+def test_grid_keys_are_unique():
+    keys = {}
+    for grid_class in (Grid, BitboardGrid):
+        positions = [grid_class(w=3, h=2)]
+        for _ in range(6):
+            positions = [
+                grid.clone().put(x, player)
+                for grid in positions
+                for x in range(grid.w) if grid.can_make_move(x)
+                for player in (PA, PB)
+            ]
+            for grid in positions:
+                text = str(grid.to2d_yx())
+                assert keys.setdefault(grid.key(), text) == text
+    assert Grid().put(3, PA).key() == BitboardGrid().put(3, PA).key()
+
+def test_results_cache_by_position_key():
+    cache = ResultsCache()
+    grid = BitboardGrid(w=4, h=4).put(0, PA).put(1, PB)
+    cache.put(grid, WIN)
+    assert cache.get(grid) == WIN
+    assert cache.get(Grid(w=4, h=4).put(0, PA).put(1, PB)) == WIN
+    assert cache.get(BitboardGrid(w=4, h=4).put(0, PB).put(1, PA)) is None
+    assert cache.get(BitboardGrid(w=4, h=4).put(0, PA)) is None
+
+def test_transposition_table_is_bounded():
+    for policy in (TranspositionTable.ALWAYS_REPLACE, TranspositionTable.DEPTH_PREFERRED):
+        cache = TranspositionTable(capacity=10, policy=policy)
+        capacity = cache.capacity
+        grids = [BitboardGrid(w=4, h=4)]
+        for _ in range(3):
+            grids = [grid.clone().put(x, player) for grid in grids for x in range(4) for player in (PA, PB)]
+        grids = list({grid.canonical_key(): grid for grid in grids}.values())
+        for grid in grids:
+            cache.put(grid, WIN)
+            assert cache.get(grid) == WIN
+        assert cache.capacity == capacity
+        assert len(cache) <= capacity
+        assert cache.evictions >= len(grids) - capacity
+        assert cache.hits == len(grids)
+
+def test_transposition_table_prefers_deeper_entries():
+    cache = TranspositionTable(capacity=2, policy=TranspositionTable.DEPTH_PREFERRED)
+    assert cache.buckets == 2
+    shallow = BitboardGrid(w=3, h=3).put(0, PA)
+    deep = [BitboardGrid(w=3, h=3).put(0, PA).put(0, PB).put(x, PA) for x in range(3)]
+    bucket = [grid for grid in deep if grid.canonical_key() % 2 == shallow.canonical_key() % 2]
+    cache.put(shallow, TIE)
+    for grid in bucket:
+        cache.put(grid, WIN)
+    assert cache.get(shallow) == TIE
+    assert cache.get(bucket[-1]) == WIN
+    assert cache.misses == 0
+
+def test_search_with_small_transposition_table():
+    grid = BitboardGrid(w=3, h=3, min_win=3)
+    cache = TranspositionTable(capacity=20)
+    assert moves_results(grid, PA, PA, cache) == [TIE, TIE, TIE]
+    assert len(cache) <= cache.capacity
+    assert cache.evictions > 0
+    assert TranspositionTable(max_bytes=6400).capacity >= 100
+
+def test_mirrored_positions_share_cache_entries():
+    for grid_class in (Grid, BitboardGrid):
+        grid = grid_class(w=5, h=4).put(0, PA).put(1, PB).put(1, PA)
+        mirrored = grid_class(w=5, h=4).put(4, PA).put(3, PB).put(3, PA)
+        assert grid.mirror_key() == mirrored.key()
+        assert grid.key() == mirrored.mirror_key()
+        assert grid.canonical_key() == mirrored.canonical_key()
+        assert grid.key() != mirrored.key()
+        cache = ResultsCache()
+        cache.put(grid, LOSE)
+        assert cache.get(mirrored) == LOSE
+    grid = BitboardGrid(w=3, h=2).put(0, PA).put(0, PB)
+    grid.set(0, 1, PA)
+    assert grid.mirror_key() == Grid(w=3, h=2).put(2, PA).put(2, PA).key()
+
+def test_moves_results_reuses_mirrored_moves():
+    grid = BitboardGrid(w=5, h=2).put(2, PA)
+    with mock.patch.object(DepthFirstSearcher, 'best_result_on_move', return_value=TIE) as best_result_on_move:
+        assert moves_results(grid, PA, PB) == [TIE] * 5
+        assert best_result_on_move.call_count == 3
+    grid.put(0, PB)
+    assert moves_results(grid, PA, PA) == moves_results(Grid.parse('''
+.....
+B.A..
+'''.strip()), PA, PA)
+
+# --- Negamax
+
+def random_positions(rng, w, h, min_win, count, moves):
+    """positions after random moves with no winner yet"""
+    positions = []
+    while len(positions) < count:
+        grid = BitboardGrid(w=w, h=h, min_win=min_win)
+        player = PA
+        for _ in range(moves):
+            grid.put(rng.choice([x for x in range(w) if grid.can_make_move(x)]), player)
+            player = opposite_player(player)
+            if grid.last_move_winner():
+                break
+        else:
+            positions.append((grid, player))
+    return positions
+
+def test_negamax_scores():
+    grid = Grid.parse('''
+....
+ABAB
+ABAB
+ABAB
+'''.strip())
+    searcher = NegamaxSearcher(PA)
+    assert searcher.score_on_move(grid, PA, 0) == 4
+    assert searcher.score_on_move(grid, PA, 1) == -3
+    assert searcher.score_on_move(grid, PA, 3) == -3
+    assert searcher.best_result_on_move(grid, PA, 2) == WIN
+    searcher = NegamaxSearcher(PA)
+    assert searcher.best_result_on_move(grid, PB, 1) == LOSE
+    assert searcher.best_result_on_move(grid, PB, 0) == WIN
+    assert NegamaxSearcher(PA).best_result_on_move(Grid.parse('BA\nAB'), PA, 0) is None
+
+def test_negamax_matches_depth_first_search():
+    rng = random.Random(6)
+    for w, h, min_win in [(4, 4, 4), (5, 4, 3), (3, 3, 2), (4, 3, 3)]:
+        for grid, player in random_positions(rng, w, h, min_win, 6, 5):
+            for my_player in (PA, PB):
+                expected = moves_results(grid, my_player, player)
+                assert moves_results(grid, my_player, player, engine='negamax') == expected
+    assert moves_results(BitboardGrid(w=3, h=3, min_win=2), PA, PB, engine='negamax') == [LOSE, LOSE, LOSE]
+
+def test_negamax_with_transposition_table():
+    grid = BitboardGrid(w=4, h=4)
+    cache = TranspositionTable(capacity=1000)
+    assert moves_results(grid, PA, PA, cache, engine='negamax') == [TIE, TIE, TIE, TIE]
+
+# --- Move ordering
+
+def test_winning_cells():
+    board = '''
+.......
+.......
+......A
+...B..A
+.B.AB.A
+AA.ABBB
+'''.strip()
+    for grid_class in (Grid, BitboardGrid):
+        grid = grid_class.parse(board)
+        cells = grid.winning_cells(PA)
+        assert cells == 1 << (6 * 7 + 4) | 1 << (2 * 7)
+        assert grid.winning_cells(PB) == 1 << (2 * 7 + 3)
+        empty_cells = sum(1 << (x * 4 + y) for x in range(3) for y in range(3))
+        assert grid_class(w=3, h=3, min_win=1).winning_cells(PB) == empty_cells
+
+def test_winning_cells_match_generic_check():
+    rng = random.Random(7)
+    for w, h, min_win in [(7, 6, 4), (5, 4, 3), (4, 5, 3), (6, 6, 5)]:
+        for grid, _ in random_positions(rng, w, h, min_win, 20, rng.randint(3, 10)):
+            generic = Grid.parse('\n'.join(''.join(cell or '.' for cell in row) for row in grid.to2d_yx()[::-1]),
+                                 min_win=min_win)
+            for player in (PA, PB):
+                assert grid.winning_cells(player) == generic.winning_cells(player)
+
+def test_move_orderings():
+    grid = BitboardGrid(w=7, h=6)
+    assert MoveOrdering().moves(grid, PA) == [0, 1, 2, 3, 4, 5, 6]
+    assert CenterOrdering().moves(grid, PA) == [3, 2, 4, 1, 5, 0, 6]
+    assert CenterOrdering().moves(BitboardGrid(w=4, h=1).put(1, PA), PA) == [2, 0, 3]
+    grid = BitboardGrid.parse('''
+.......
+.......
+.......
+.......
+.......
+.AA....
+'''.strip())
+    assert ThreatOrdering().moves(grid, PA) == [3, 4, 0, 2, 1, 5, 6]
+
+def test_search_results_do_not_depend_on_ordering():
+    grid = BitboardGrid(w=5, h=4, min_win=3)
+    for engine in sorted(searchers):
+        for ordering in sorted(move_orderings):
+            assert moves_results(grid, PA, PA, engine=engine, ordering=ordering) == [LOSE, WIN, WIN, WIN, LOSE]
+
+# --- Forced moves
+
+def test_immediate_win_and_double_threat_are_not_searched():
+    grid = BitboardGrid.parse('''
+.......
+.......
+.......
+.......
+B......
+BB.AAA.
+'''.strip())
+    stats = SearchStats()
+    assert DepthFirstSearcher(PA, stats=stats).best_result(grid, PA) == WIN
+    assert DepthFirstSearcher(PB, stats=stats).best_result(grid, PB) == LOSE
+    assert stats.nodes == 2
+    assert stats.cutoffs == {'threats': 2}
+    assert NegamaxSearcher(PB).negamax(grid, PB, -43, 43) == -(42 - 6 - 1)
+    assert NegamaxSearcher(PB).negamax(grid, PA, -43, 43) == 42 - 6
+
+def test_forced_block_and_losing_moves():
+    grid = BitboardGrid.parse('''
+.......
+.......
+.......
+.......
+.......
+.AAA.BB
+'''.strip())
+    stats = SearchStats()
+    searcher = DepthFirstSearcher(PA, stats=stats)
+    assert searcher.best_result(grid, PB) == WIN
+    assert stats.nodes == 1
+    grid = BitboardGrid.parse('''
+.......
+.......
+.......
+.......
+.......
+BAAA...
+'''.strip())
+    # the only move searched is the blocking one, without asking the ordering
+    with mock.patch.object(MoveOrdering, 'moves') as ordering_moves:
+        result, moves, _ = searcher._moves_to_search(grid, PB)
+        assert (result, moves) == (None, [4])
+        assert ordering_moves.call_count == 0
+    grid = BitboardGrid.parse('''
+.......
+.......
+.......
+.......
+BAAA...
+BAAA...
+'''.strip())
+    # the only blocking move lets A win right above it
+    stats.nodes = 0
+    assert searcher.best_result(grid, PB) == WIN
+    assert stats.nodes == 1
+    assert NegamaxSearcher(PB).negamax(grid, PB, -43, 43) == -(42 - 8 - 1)
+
+def test_stack_search_matches_recursive_results():
+    def recursive_result(grid, my_player, next_player):
+        """plain minimax over W/L/T results, for reference"""
+        winner = grid.winner()
+        if winner:
+            return WIN if winner == my_player else LOSE
+        results = [recursive_result(grid.clone().put(move, next_player), my_player, opposite_player(next_player))
+                   for move in range(grid.w) if grid.can_make_move(move)]
+        if not results:
+            return TIE
+        return max_possible_move(results) if next_player == my_player else min_possible_move(results)
+
+    rng = random.Random(19)
+    for w, h, min_win in ((3, 3, 3), (4, 3, 3), (3, 4, 3)):
+        for grid, player in random_positions(rng, w, h, min_win, 6, rng.randint(1, 4)):
+            for my_player in (PA, PB):
+                key, history = grid.key(), grid.history[:]
+                assert DepthFirstSearcher(my_player, ordering=CenterOrdering()).best_result(grid, player) \
+                    == recursive_result(grid, my_player, player)
+                assert (grid.key(), grid.history) == (key, history)
+
+def test_stack_search_deeper_than_recursion_limit():
+    # alternating discs in a single column never make 3 in a row
+    for cls in (Grid, BitboardGrid):
+        grid = cls(w=1, h=sys.getrecursionlimit() + 200, min_win=3)
+        assert DepthFirstSearcher(PA).best_result(grid, PA) == TIE
+        assert grid.moves == 0
+
+# --- Breadth-first search
+
+def test_breadth_first_search_matches_depth_first():
+    rng = random.Random(21)
+    for w, h, min_win in ((3, 3, 3), (4, 3, 3), (4, 4, 3), (4, 4, 4)):
+        for grid, player in random_positions(rng, w, h, min_win, 4, rng.randint(0, 5)):
+            key = grid.key()
+            for my_player in (PA, PB):
+                assert moves_results(grid, my_player, player, engine='bfs') \
+                    == moves_results(grid, my_player, player, engine='dfs')
+            assert grid.key() == key
+
+def test_breadth_first_search_merges_and_prunes():
+    grid = BitboardGrid.from_moves('2231', 4, 4, 4)
+    stats = SearchStats()
+    expected = moves_results(grid, PA, PA, engine='dfs')
+    assert moves_results(grid, PA, PA, engine='bfs', ordering='center', stats=stats) == expected
+    assert stats.cutoffs['pruned'] > 0
+    # each player has their own searcher, results are from their point of view
+    grid = BitboardGrid.from_moves('22312', 4, 4, 4)
+    result_a = BreadthFirstSearcher(PA).best_result(grid, PA)
+    assert result_a == DepthFirstSearcher(PA).best_result(grid, PA)
+    assert BreadthFirstSearcher(PB).best_result(grid, PA) == {WIN: LOSE, LOSE: WIN, TIE: TIE}[result_a]
+
+def test_search_nodes_propagate_results():
+    searcher = BreadthFirstSearcher(PA)
+    nodes = SearchNodes(3, 3, 3)
+    root = nodes.add(BitboardGrid(3, 3, 3).key(), PA)
+    child = nodes.add(BitboardGrid(3, 3, 3).put(0, PA).key(), PB, root)
+    other = nodes.add(BitboardGrid(3, 3, 3).put(1, PA).key(), PB, root)
+    nodes.add_parent(other, root)
+    assert list(nodes.parents(other)) == [root, root]
+    assert list(nodes.parents(root)) == []
+    nodes.pending[root], nodes.pending[child] = 3, 2
+    assert not searcher._recalculate(nodes, child, TIE)
+    assert searcher._recalculate(nodes, child, WIN)  # B avoids the move letting A win
+    assert nodes.result(child) == TIE
+    searcher._pass_up(nodes, child)
+    assert searcher.results_cache.get(nodes.grid(child)) == TIE
+    assert nodes.result(root) is None and nodes.pending[root] == 2
+    assert searcher._recalculate(nodes, root, WIN)  # A takes the winning move
+    assert nodes.result(root) == WIN
+    assert not searcher._recalculate(nodes, root, LOSE)
+
+def test_bitboard_grid_from_key():
+    rng = random.Random(22)
+    for grid, _ in random_positions(rng, 7, 6, 4, 10, 12):
+        rebuilt = BitboardGrid.from_key(grid.key(), 7, 6, 4)
+        assert rebuilt.to2d_yx() == grid.to2d_yx()
+        assert (rebuilt.key(), rebuilt.mirror_key(), rebuilt.moves) == (grid.key(), grid.mirror_key(), grid.moves)
+        assert rebuilt.undo().moves == grid.moves - 1
+
+# --- Iterative deepening
+
+def test_depth_limited_probes_are_sound():
+    grid = BitboardGrid.parse('''
+....
+ABAB
+ABAB
+ABAB
+'''.strip())
+    searcher = NegamaxSearcher(PA)
+    assert searcher.probe_result_on_move(grid, PA, 0, 0) == WIN
+    assert searcher.probe_result_on_move(grid, PA, 1, 0) == LOSE
+    assert searcher.probe_result_on_move(grid, PA, 1, 5) == LOSE
+    grid = BitboardGrid(w=4, h=4)
+    searcher = NegamaxSearcher(PA)
+    for depth in range(14):
+        assert searcher.probe_result_on_move(grid, PA, 0, depth) in {None, TIE}
+    assert searcher.probe_result_on_move(grid, PA, 0, 14) == TIE
+    assert searcher.probe_result_on_move(grid, PA, 4 - 1, 0) == TIE
+
+def test_iterative_deepening_yields_partial_results():
+    grid = BitboardGrid(w=5, h=4, min_win=3)
+    searcher = IterativeDeepeningSearcher(PA)
+    iterations = list(searcher.iterate_moves_results(grid, PA))
+    depths = [depth for depth, _ in iterations]
+    assert depths == list(range(len(iterations)))
+    for _, results in iterations:
+        assert all(result in {None, WIN, LOSE, TIE} for result in results)
+    assert iterations[-1][1] == [LOSE, WIN, WIN, WIN, LOSE]
+    assert list(IterativeDeepeningSearcher(PA).iterate_moves_results(grid, PA, max_depth=0))[-1][0] == 0
+    rng = random.Random(9)
+    for grid, player in random_positions(rng, 4, 4, 4, 6, 4):
+        assert moves_results(grid, PB, player, engine='iterative') == moves_results(grid, PB, player)
+
+# --- Budgeted solve
+
+def test_solve_within_nodes_budget():
+    grid = BitboardGrid(w=6, h=5)
+    solutions = solve(grid, PB, PA, max_nodes=300)
+    assert [solution.result for solution in solutions] == [UNKNOWN] * 6
+    assert all(solution.depth is not None for solution in solutions)
+    assert all(solution.evaluation is not None for solution in solutions)
+
+def test_solve_with_enough_budget_proves_all_moves():
+    grid = BitboardGrid.parse('''
+....
+.B..
+.AB.
+AAB.
+'''.strip())
+    solutions = solve(grid, PB, PB, deadline=time.time() + 60, max_nodes=10 ** 6)
+    assert [solution.result for solution in solutions] == moves_results(grid, PB, PB)
+    full = Grid.parse('A.\nB.', min_win=2)
+    solutions = solve(full, PA, PA, max_nodes=10 ** 6)
+    assert solutions[0] is None
+    assert solutions[1].result == WIN
+
+def test_solve_evaluates_only_unproven_moves_at_the_end():
+    grid = BitboardGrid.from_moves('2231', 4, 4, 4)
+    stats = SearchStats()
+    solutions = solve(grid, PA, PA, max_nodes=10 ** 6, stats=stats)
+    assert all(solution.evaluation is None for solution in solutions)
+    probes_stats = SearchStats()
+    searcher = IterativeDeepeningSearcher(PA, ordering=CenterOrdering(), stats=probes_stats)
+    *_, (_, results) = searcher.iterate_moves_results(grid, PA)
+    assert [solution.result for solution in solutions] == results
+    assert stats.nodes == probes_stats.nodes
+
+def test_solve_after_deadline():
+    grid = BitboardGrid(w=4, h=4)
+    solutions = solve(grid, PA, PA, deadline=time.time() - 1)
+    assert [(solution.result, solution.depth) for solution in solutions] == [(UNKNOWN, None)] * 4
+
+# --- Parallel search
+
+def test_parallel_moves_results():
+    grid = BitboardGrid(w=5, h=4, min_win=3)
+    assert moves_results_parallel(grid, PA, PA, workers=2) == [LOSE, WIN, WIN, WIN, LOSE]
+    grid.put(1, PA)
+    expected = moves_results(grid, PA, PB)
+    assert moves_results_parallel(grid, PA, PB, workers=2, engine='negamax', split_replies=True) == expected
+    assert moves_results_parallel(grid, PB, PB, workers=2, split_replies=True) == moves_results(grid, PB, PB)
+    full = Grid.parse('A.\nB.', min_win=3)
+    assert moves_results_parallel(full, PA, PA, workers=1, split_replies=True) == [None, TIE]
+
+def test_cache_values_encoding():
+    for value in (WIN, LOSE, TIE, (0, 0), (-42, 42), (-3, 17), (-4095, 4095)):
+        assert decode_cache_value(encode_cache_value(value)) == value
+        assert encode_cache_value(value)
+
+def test_shared_results_cache():
+    cache = SharedResultsCache(capacity=100)
+    try:
+        grid = BitboardGrid(w=7, h=6).put(0, PA).put(6, PB)
+        cache.put(grid, WIN)
+        cache.put(BitboardGrid(w=7, h=6).put(3, PA), (-5, 7))
+        attached = pickle.loads(pickle.dumps(cache))
+        assert attached.get(BitboardGrid(w=7, h=6).put(6, PA).put(0, PB)) == WIN
+        assert attached.get(BitboardGrid(w=7, h=6).put(3, PA)) == (-5, 7)
+        assert attached.get(BitboardGrid(w=7, h=6).put(3, PB)) is None
+        attached.close()
+        # torn slot doesn't match its key
+        offset = (grid.canonical_key() % cache.capacity) * cache.SLOT.size
+        cache.memory.buf[offset] ^= 0xff
+        assert cache.get(grid) is None
+        assert len(cache) == 2
+        with pytest.raises(ValueError):
+            cache.get(BitboardGrid(w=9, h=7))
+    finally:
+        cache.close()
+
+def test_parallel_moves_results_with_shared_cache():
+    grid = BitboardGrid(w=5, h=4, min_win=3).put(2, PA)
+    for engine in ('dfs', 'negamax'):
+        assert moves_results_parallel(grid, PA, PB, workers=2, engine=engine, split_replies=True,
+                                      shared_cache_size=1000) == moves_results(grid, PA, PB)
+
+# --- Persistent results cache
+
+def test_disk_results_cache(tmp_path):
+    path = str(tmp_path / 'results.c4')
+    cache = ResultsCache()
+    grid = BitboardGrid(w=5, h=4, min_win=3)
+    assert moves_results(grid, PA, PA, cache) == [LOSE, WIN, WIN, WIN, LOSE]
+    cache.flush(path, 5, 4, 3, PA)
+
+    disk = DiskResultsCache(path)
+    assert disk.matches(5, 4, 3, PA)
+    assert not disk.matches(5, 4, 3, PB)
+    assert not disk.matches(5, 4, 4, PA)
+    assert len(list(disk.items())) == len(cache)
+    for key, result in cache.items():
+        assert disk.get_key(key) == result
+    assert disk.get_key(0) is None
+    assert disk.get_key(1 << 30) is None
+
+    warm = ResultsCache(backing=disk)
+    with mock.patch.object(DepthFirstSearcher, '_best_result') as best_result:
+        assert moves_results(grid, PA, PA, warm) == [LOSE, WIN, WIN, WIN, LOSE]
+        assert best_result.call_count == 0
+    assert warm.misses == 0
+    disk.close()
+
+def test_disk_results_cache_merges_score_bounds(tmp_path):
+    path = str(tmp_path / 'bounds.c4')
+    first = TranspositionTable(capacity=1000)
+    moves_results(BitboardGrid(w=4, h=4).put(0, PA), PA, PB, first, engine='negamax')
+    first.flush(path, 4, 4, 4, None)
+    disk = DiskResultsCache(path)
+    second = ResultsCache(backing=disk)
+    assert moves_results(BitboardGrid(w=4, h=4).put(1, PA), PA, PB, second, engine='negamax') \
+        == moves_results(BitboardGrid(w=4, h=4).put(1, PA), PA, PB, engine='negamax')
+    assert second.hits > 0
+    second.flush(path, 4, 4, 4, None)
+    merged = DiskResultsCache(path)
+    assert merged.perspective is None
+    assert merged.count == len(first) + len(second) - len(set(dict(first.items())) & set(second.cache))
+    disk.close()
+    merged.close()
+
+def test_flush_merges_sorted_entries(tmp_path):
+    path = str(tmp_path / 'merged.c4')
+    DiskResultsCache.save(path, [(3, LOSE), (8, TIE), (10, TIE)], 3, 3, 3, PA)
+    disk = DiskResultsCache(path)
+    cache = ResultsCache(backing=disk)
+    cache.cache.update({8: WIN, 5: TIE})
+    cache.flush(path, 3, 3, 3, PA)
+    merged = DiskResultsCache(path)
+    assert list(merged.items()) == [(3, LOSE), (5, TIE), (8, WIN), (10, TIE)]
+    disk.close()
+    merged.close()
+
+# --- Opening book
+
+def test_opening_book(tmp_path):
+    path = str(tmp_path / 'book.c4')
+    assert OpeningBook.generate(path, 5, 4, 3, 2) > 1
+    book = OpeningBook(path)
+    empty = BitboardGrid(w=5, h=4, min_win=3)
+    assert book.get(empty, PA) == [LOSE, WIN, WIN, WIN, LOSE]
+    with mock.patch.object(DepthFirstSearcher, 'best_result_on_move') as best_result_on_move:
+        assert moves_results(empty, PA, PA, book=book) == [LOSE, WIN, WIN, WIN, LOSE]
+        assert moves_results(empty, PB, PA, book=book) == [WIN, LOSE, LOSE, LOSE, WIN]
+        assert best_result_on_move.call_count == 0
+    rng = random.Random(14)
+    for _ in range(10):
+        grid = empty.clone()
+        for moves in range(rng.randint(1, 2)):
+            grid.put(rng.randrange(5), PA if moves % 2 == 0 else PB)
+        player = PA if grid.moves % 2 == 0 else PB
+        assert book.get(grid, player) == moves_results(grid, player, player)
+        assert book.get(grid, opposite_player(player)) is None
+    assert book.get(empty.clone().put(0, PA).put(1, PB).put(2, PA), PB) is None
+    assert book.get(BitboardGrid(w=5, h=4, min_win=4), PA) is None
+    book.close()
+
+# --- Tablebase
+
+def test_tablebase_index_is_perfect():
+    keys = set()
+    rng = random.Random(23)
+    for grid, _ in random_positions(rng, 4, 3, 3, 200, rng.randint(0, 8)):
+        keys.add(grid.key())
+    radix = (1 << 4) - 1
+    indexes = {Tablebase.key_index(key, 4, 3) for key in keys}
+    assert len(indexes) == len(keys)
+    assert all(0 <= index < radix ** 4 for index in indexes)
+    assert Tablebase.key_index(BitboardGrid(4, 3).key(), 4, 3) == 0
+
+def test_tablebase(tmp_path):
+    path = str(tmp_path / 'tablebase.c4')
+    assert Tablebase.generate(path, 4, 3, 3) > 1000
+    tablebase = Tablebase(path)
+    empty = BitboardGrid(w=4, h=3, min_win=3)
+    assert tablebase.result(empty) == WIN
+    rng = random.Random(23)
+    for grid, player in random_positions(rng, 4, 3, 3, 30, rng.randint(0, 7)):
+        assert tablebase.get(grid, player) == moves_results(grid, player, player, engine='negamax')
+        assert tablebase.get(grid, opposite_player(player)) is None
+    lost = BitboardGrid.from_moves('11223', 4, 3, 3)
+    assert tablebase.result(lost) == LOSE
+    assert tablebase.get(BitboardGrid(w=4, h=4, min_win=3), PA) is None
+    with mock.patch.object(DepthFirstSearcher, 'best_result_on_move') as best_result_on_move:
+        assert moves_results(empty, PB, PA, book=tablebase) == [LOSE] * 4
+        assert best_result_on_move.call_count == 0
+    tablebase.close()
+
+# --- Batch analysis
+
+def test_parse_position():
+    grid, player = parse_position('..../..../.B../AAB.', 4, 4, 4)
+    assert (grid.w, grid.h, grid.moves, player) == (4, 4, 4, PA)
+    assert grid.get(1, 1) == PB
+    grid, player = parse_position(' 2231\n', 4, 4, 4)
+    assert player == PA
+    assert grid.to2d_yx() == parse_position('..../..../.B../BAA.', 4, 4, 4)[0].to2d_yx()
+    assert parse_position('223', 4, 4, 4)[1] == PB
+    with pytest.raises(ValueError):
+        parse_position('25', 4, 4, 4)
+    with pytest.raises(ValueError):
+        parse_position('11111', 4, 4, 4)
+    with pytest.raises(ValueError):
+        parse_position('..../..../..../AAA.', 4, 4, 4)
+    with pytest.raises(ValueError):
+        parse_position('..../..../..../B...', 4, 4, 4)
+    for line in ('12x', '..../..../..../AB.', '..../..../..../ABx.', '..../..../AB../..../', '...../...../...../..A..',
+                 'A.../..../..../.B..', '..../..../BBB./AAAA', '...B/...B/.BBB/AAAA', '1212121'):
+        with pytest.raises(ValueError):
+            parse_position(line, 4, 4, 4)
+
+def test_analyze_positions_stream():
+    lines = ['', '2231', '..../..../.B../BAA.', '..../..../..../..A.', '19', '223']
+    analyses = list(analyze_positions(iter(lines), 4, 4, 4))
+    assert len(analyses) == 5
+    assert analyses[0] == {'position': '2231', 'player': PA, 'results': moves_results(
+        parse_position('2231', 4, 4, 4)[0], PA, PA)}
+    assert analyses[1]['results'] == analyses[0]['results']
+    assert analyses[2]['player'] == PB
+    assert len(analyses[2]['results']) == 4
+    assert 'error' in analyses[3]
+    expected = moves_results(parse_position('223', 4, 4, 4)[0], PB, PB)
+    assert analyses[4]['results'] == expected
+    json.dumps(analyses)
+
+def test_batch_moves_results():
+    rng = random.Random(25)
+    positions = []
+    for w, h, min_win in ((4, 4, 4), (5, 4, 3), (4, 4, 3)):
+        for grid, player in random_positions(rng, w, h, min_win, 3, 5):
+            positions.append((grid, player, player))
+            positions.append((grid, opposite_player(player), player))
+    rng.shuffle(positions)
+    stats = SearchStats()
+    solved = batch_moves_results(iter(positions), 'negamax', 'center', stats=stats)
+    assert next(solved)[0] is positions[0]
+    solved = list(batch_moves_results(iter(positions), 'negamax', 'center', stats=stats))
+    assert [position for position, _ in solved] == positions
+    separate_stats = SearchStats()
+    for (grid, my_player, moving_player), results in solved:
+        assert results == moves_results(grid, my_player, moving_player, engine='negamax', ordering='center',
+                                         stats=separate_stats)
+    # warm shared caches take fewer nodes to solve the positions than fresh ones
+    assert stats.nodes < separate_stats.nodes
+
+def test_batch_moves_results_with_either_player_moving_first():
+    rng = random.Random(2025)
+    positions = []
+    for first_player in (PA, PB, PA, PB):
+        positions.append((Grid(w=3, h=3, min_win=3), PA, first_player))
+        for grid, player in random_positions(rng, 4, 4, 3, 2, 3):
+            moving_player = player if first_player == PA else opposite_player(player)
+            positions.append((grid, PA, moving_player))
+    for (grid, my_player, moving_player), results in batch_moves_results(positions):
+        assert results == moves_results(grid, my_player, moving_player)
+
+def test_analyze_positions_keeps_errors_in_order():
+    analyses = list(analyze_positions(['11111', '2231', '19', '5', '223', '41'], 4, 4, 4))
+    assert [analysis['position'] for analysis in analyses] == ['11111', '2231', '19', '5', '223', '41']
+    assert ['error' in analysis for analysis in analyses] == [True, False, True, True, False, False]
+
+def test_cli_moves():
+    with mock.patch.object(sys, 'argv', ['c4solver.py', '--moves', '223', '--engine', 'negamax']):
+        with MockOutput() as mocko:
+            main()
+    expected = moves_results(BitboardGrid.from_moves('223', 4, 4, 4), PB, PB)
+    for idx, result in enumerate(expected):
+        mocko.assert_contains('move: {}, result: {}'.format(idx, result))
+    with mock.patch.object(sys, 'argv', ['c4solver.py', '--moves', '25']):
+        with pytest.raises(RuntimeError):
+            main()
+
+# --- Benchmark
+
+def test_run_benchmark():
+    positions = [('3x3 opening', 3, 3, 3, ''), ('4x4 midgame', 4, 4, 4, '2231')]
+    measurements = list(run_benchmark(positions))
+    assert [m['position'] for m in measurements] == ['3x3 opening', '4x4 midgame']
+    assert measurements[1]['board'] == '4x4'
+    assert measurements[1]['results'] == moves_results(BitboardGrid.from_moves('2231', 4, 4, 4), PA, PA)
+    for measurement in measurements:
+        assert measurement['nodes'] > 0
+        assert measurement['nodes_per_sec'] > 0
+        assert 0 <= measurement['cache_hit_rate'] <= 1
+        assert measurement['peak_memory_kb'] > 0
+        assert measurement['max_depth'] > 0
+    json.dumps(measurements)
+
+def test_benchmark_positions_are_valid():
+    for name, w, h, min_win, moves in benchmark_positions:
+        grid = BitboardGrid.from_moves(moves, w, h, min_win)
+        assert grid.last_move_winner() is None
+
+# --- Search stats
+
+def test_search_stats_counts():
+    grid = BitboardGrid.from_moves('2231', 4, 4, 4)
+    for engine in ('dfs', 'negamax'):
+        stats = SearchStats()
+        results = moves_results(grid, PA, PA, engine=engine, ordering='center', stats=stats)
+        assert results == moves_results(grid, PA, PA, engine=engine, ordering='center')
+        assert stats.nodes > 0
+        assert stats.cache_hits + stats.cache_misses > 0
+        assert stats.cutoffs.get('beta', 0) > 0
+        assert 0 < stats.max_depth <= 16 - 4
+        json.dumps(stats.to_dict())
+
+def test_search_stats_per_searcher():
+    grid = BitboardGrid(3, 3, 3)
+    stats1, stats2 = SearchStats(), SearchStats()
+    moves_results(grid, PA, PA, engine='negamax', stats=stats1)
+    moves_results(grid, PA, PA, engine='negamax', stats=stats2)
+    assert stats1.nodes == stats2.nodes > 0
+
+def test_search_stats_progress():
+    reports = []
+    stats = SearchStats(lambda s: reports.append(s.nodes), interval=10)
+    moves_results(BitboardGrid(4, 4, 4), PA, PA, engine='negamax', ordering='center', stats=stats)
+    assert reports == list(range(10, stats.nodes + 1, 10))
+
+def test_search_stats_depth_times():
+    stats = SearchStats()
+    searcher = IterativeDeepeningSearcher(PA, ordering=CenterOrdering(), stats=stats)
+    iterations = list(searcher.iterate_moves_results(BitboardGrid(3, 3, 3), PA))
+    assert sorted(stats.depth_times) == [depth for depth, _ in iterations]
+    assert all(seconds >= 0 for seconds in stats.depth_times.values())
+
+def test_cli_iterative_on_full_board():
+    with mock.patch.object(sys, 'argv', ['c4solver.py', '--width', '2', '--height', '2', '--min-win', '3',
+                                         '--moves', '1122', '--engine', 'iterative']):
+        with MockOutput() as mocko:
+            main()
+    mocko.assert_contains('move: 0, result: None')
+    mocko.assert_contains('move: 1, result: None')
+
+def test_cli_workers_ignore_local_options(tmp_path):
+    cache_file = str(tmp_path / 'results.c4')
+    with mock.patch.object(sys, 'argv', ['c4solver.py', '--width', '3', '--height', '3', '--min-win', '3',
+                                         '--workers', '1', '--cache-file', cache_file]):
+        with MockOutput() as mocko:
+            main()
+    mocko.assert_contains('cache-file is not supported with workers')
+    mocko.assert_contains('move: 1, result: T')
+    assert 'nodes:' not in mocko.output()
+    assert 'cache hits:' not in mocko.output()
+    assert not os.path.exists(cache_file)